@@ -26,6 +26,8 @@ sys.path.append(root + "/CongManager")
 sys.path.append(root + "/Util")
 sys.path.append(root + "/Default")
 
+from Util import GraphIO
+
 
 class Analyzer():
 
@@ -98,10 +100,9 @@ class Analyzer():
 
     def __writeCommGraph(self, comm_graph_path, comm_graph):
         full_comm_graph_path = root + "/" + comm_graph_path
-        with open(full_comm_graph_path, "w") as f:   # TODO: 文件未存在的时候应该创建一个
-            for req in comm_graph:
-                req_ = list(deepflatten(req))
-                f.write(",".join(str(x) for x in req_) + "\n")
+        # requests of finer granularity are flattened to ragged rows of extra columns, see Util/GraphIO
+        task_graph, extra = GraphIO.fromRows(list(deepflatten(req)) for req in comm_graph)
+        GraphIO.saveGraph(full_comm_graph_path, task_graph, extra)
 
 
 if __name__ == "__main__":
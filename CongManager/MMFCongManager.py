@@ -0,0 +1,94 @@
+import AddPath
+import numpy as np
+import scipy.sparse as sp
+from VirCongManager import VirCongManager
+from Util import XYRouting as RS
+from Util.PathSet import expandRanges
+from Util.TaskGraph import TaskGraph
+
+
+class MMFCongManager(VirCongManager):
+    '''Max-min fair injection rates
+        Every channel between two routers carries w * bw bits per cycle, which is shared by flows passing it
+        in the max-min fair way: no flow could get a higher rate without lowering the rate of a flow with
+        an equal or lower rate. Rates are computed by progressive filling, where all flows grow together and
+        each round freezes flows passing every channel saturated at the same level, so the number of rounds
+        is the number of distinct bottleneck levels.
+        Flows passing no channel (inside a router) are given w * bw.
+        Transmission rates in G_R are # of bits per cycle, the same as WUCongManager.
+    '''
+    scale = 1
+
+    def __init__(self):
+        print("Log: Employed Max-Min-Fair-Congestion-Manager.")
+        self.cache = {}
+
+    def doInjection(self, task_arg, arch_arg):
+        self.__setTaskArch(task_arg, arch_arg)
+        self.__setIncidence()
+        self.__progressiveFilling()
+        ret = [{
+            "G_V": self.task_graph,
+            "G_R": self.task_graph.withVol(self.cache["G_R"] * self.scale),
+            "l": task_arg["l"],
+            "cv_A": task_arg["cv_A"]
+        }]          # we have only one graph now
+        print("max injection rate(bits/cycle)", np.max(ret[0]["G_R"].vol, initial=0))
+        return ret
+
+    def __setTaskArch(self, task_arg, arch_arg):
+        self.task_graph = TaskGraph(task_arg["G"])
+        self.arch_arg = arch_arg
+        self.rter = RS.XYRouting(self.arch_arg)
+
+    def __setIncidence(self):
+        '''Route requests and build the channel-by-flow incidence matrix, see WUCongManager'''
+        d = self.arch_arg["d"]
+        pkt_path = self.rter.path(self.task_graph)
+        passing = pkt_path.channel >= 0      # the last hop leaves through the output port
+        Indptr = np.zeros(len(pkt_path) + 1, dtype=np.int64)
+        np.cumsum(pkt_path.hops() - 1, out=Indptr[1:])
+        flow2ch = sp.csc_matrix((np.ones(np.count_nonzero(passing), dtype=np.int8), pkt_path.channel[passing], Indptr),
+                                shape=(4 * d**2 - 4 * d, len(pkt_path)))
+        self.cache["flow2ch"], self.cache["ch2flow"] = flow2ch, flow2ch.tocsr()
+
+    def __progressiveFilling(self, rtol=1e-9):
+        '''Raise rates of all unfrozen flows together until some channels are saturated, then freeze flows
+        passing them, until every flow is frozen
+            rtol: Channels saturated within rtol of the lowest level are frozen in the same round
+        '''
+        flow2ch, ch2flow = self.cache["flow2ch"], self.cache["ch2flow"]
+        capacity = self.arch_arg["w"] * self.arch_arg["bw"]
+
+        G_R = np.zeros(flow2ch.shape[1])
+        frozen = np.diff(flow2ch.indptr) == 0
+        G_R[frozen] = capacity
+        remain = np.full(flow2ch.shape[0], float(capacity))
+        active_cnt = np.diff(ch2flow.indptr)        # # of unfrozen flows passing each channel
+        level, rounds = 0.0, 0
+        while not frozen.all():
+            # Each unfrozen flow could grow by the fair share of its tightest channel
+            Used = np.nonzero(active_cnt)[0]
+            Share = np.maximum(remain[Used], 0) / active_cnt[Used]
+            inc = np.min(Share)
+            Bottleneck = Used[Share <= inc + rtol * max(inc, level)]
+            level += inc
+            remain[Used] -= inc * active_cnt[Used]
+
+            # Freeze unfrozen flows passing bottleneck channels
+            Index, _ = expandRanges(ch2flow.indptr[Bottleneck], ch2flow.indptr[Bottleneck + 1])
+            Flow = np.unique(ch2flow.indices[Index])
+            Flow = Flow[~frozen[Flow]]
+            G_R[Flow] = level
+            frozen[Flow] = True
+            Index, _ = expandRanges(flow2ch.indptr[Flow], flow2ch.indptr[Flow + 1])
+            active_cnt -= np.bincount(flow2ch.indices[Index], minlength=len(active_cnt))
+            rounds += 1
+
+        self.cache["G_R"] = G_R
+        self.cache["rounds"] = rounds
+
+
+if __name__ == "__main__":
+    cm = MMFCongManager()
+    print(cm.doInjection({"G": [(0, 2, 3), (3, 2, 4), (1, 2, 5)], "l": 64, "cv_A": 1}, {"d": 4, "w": 16, "bw": 1}))
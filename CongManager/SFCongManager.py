@@ -4,7 +4,9 @@ sys.path.append("..")
 
 # from Estimator import path_based
 import math
+import numpy as np
 from VirCongManager import VirCongManager
+from Util.TaskGraph import TaskGraph
 
 
 class SFCongManager(VirCongManager):
@@ -28,16 +30,14 @@ class SFCongManager(VirCongManager):
 
     def doInjection(self, task_arg, arch_arg):
         self.setTask(task_arg)
-        G = self.task["G"]
-        G.sort(key=lambda x: x[-1])
+        G = TaskGraph(self.task["G"])
+        G = G.take(np.argsort(G.vol, kind="stable"))
         partition = self.__partition()
-        sub_graphs = [G[p[0]: p[1]] for p in partition]
-        ijct_vols = list(map(lambda g: [r[-1] for r in g], sub_graphs))
-        ijct_rates = list(map(lambda g: [self.scale * v / sum(g) for v in g], ijct_vols))
+        sub_graphs = [G[p[0]: p[1]] for p in partition]     # views of the sorted graph
         ijct_graphs = []
-        for subg, rate in zip(sub_graphs, ijct_rates):
+        for subg in sub_graphs:
             ijctg = {
-                "G_R": [(p[0], p[1], r) for p, r in zip(subg, rate)]
+                "G_R": subg.withVol(self.scale * subg.vol / np.sum(subg.vol))
             }
             ijctg["G_V"] = subg
             ijctg["cv_A"], ijctg["l"] = self.task["cv_A"], self.task["pkt_size"]
@@ -59,7 +59,7 @@ class SFCongManager(VirCongManager):
         l_ = len(self.task["G"])
         sep = [0]
         while sep[-1] < l_:
-            sep.append(sep[-1] + math.ceil(l_*power))
+            sep.append(sep[-1] + max(1, math.ceil(l_*power)))      # power underflows to 0 for large graphs
             power = power * alpha
         sep = [i for i in sep if i > 0 and i < l_]
         begin = [0] + sep
@@ -10,7 +10,7 @@ class VirCongManager:
             Return: A list of task graphs which are represented as a dict with items:
                 cv_A: coefficiency of the packet size (for modeling burstness)
                 l: average packet size
-                G_R: [(src, dst, injection rate)]
-                G: [(src, dst, transmission volume)]
+                G_R: A TaskGraph of (src, dst, injection rate)
+                G_V: A TaskGraph of (src, dst, transmission volume)
         '''
         return []
@@ -1,9 +1,16 @@
 import AddPath
 import numpy as np
+import scipy.sparse as sp
 from VirCongManager import VirCongManager
 from Util import XYRouting as RS
+from Util.PathSet import expandRanges
+from Util.TaskGraph import TaskGraph
 
 class WUCongManager(VirCongManager):
+    '''Weighted-uniform water filling of channel bandwidth
+        The manager is stateful: routes and the channel-by-flow incidence of the last doInjection are kept,
+        so that applyDelta could update rates after a few requests are changed, e.g. in a mapping loop.
+    '''
     scale = 10
 
     def __init__(self):
@@ -14,57 +21,172 @@ class WUCongManager(VirCongManager):
         self.__setTaskArch(task_arg, arch_arg)
         self.__forwardPropagation()
         self.__backwardPropagation()
+        return self.__output()
+
+    def applyDelta(self, removed_flows, added_flows):
+        '''Update injection rates after a few requests of the task graph of the last doInjection are changed
+        Only added requests are routed, and water filling is replayed only on channels reached from changed
+        requests through flows whose share has changed, see __refill. Rates are the same as doInjection on the
+        new task graph.
+            removed_flows: An iterable of requests (src, dst, ...) to be removed, matched by (src, dst)
+            added_flows: An iterable of requests (src, dst, vol) to be added
+            Return:
+                The same as doInjection, where the task graph is the remaining requests in their original order
+                followed by added ones
+        '''
+        if "G_R" not in self.cache:
+            raise Exception("applyDelta should follow a doInjection")
+        added_flows = TaskGraph(added_flows)
+        Removed = self.__match(removed_flows)
+        Kept = np.setdiff1d(np.arange(len(self.task_graph)), Removed)
+        self.task_graph = TaskGraph.concat([self.task_graph.take(Kept), added_flows])
+        Src, Dst = added_flows.src.astype(np.int64), added_flows.dst.astype(np.int64)
+        self.cache["key"] = np.concatenate((self.cache["key"][Kept], TaskGraph.pairKeys(Src, Dst)))
+
+        # Drop columns of removed requests from the incidence and append those of added ones
+        flow2ch = self.cache["flow2ch"]
+        Hops = np.diff(flow2ch.indptr)
+        Kept_hop = np.repeat(np.isin(np.arange(len(Hops)), Kept), Hops)
+        add_path = self.rter.route(Src, Dst)
+        Add_channel = add_path.channel[add_path.channel >= 0]
+        Touched = np.concatenate((flow2ch.indices[~Kept_hop], Add_channel))
+        Indptr = np.zeros(len(self.task_graph) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate((Hops[Kept], add_path.hops() - 1)), out=Indptr[1:])
+        self.__setIncidence(np.concatenate((flow2ch.indices[Kept_hop], Add_channel)), Indptr)
+
+        # Channels of changed requests, and channels of flows settled by them, are filled again
+        settle = np.concatenate((self.cache["settle"][Kept], np.full(len(added_flows), -1)))
+        self.cache["settle"] = settle
+        self.cache["ratio"] = np.concatenate((self.cache["ratio"][Kept], np.zeros(len(added_flows))))
+        Dirty = np.zeros(len(self.cache["vst_cnt"]), dtype=bool)
+        Dirty[Touched] = True
+        Flow = np.nonzero((settle >= 0) & Dirty[settle])[0]
+        Index, _ = expandRanges(Indptr[Flow], Indptr[Flow + 1])
+        Dirty[self.cache["flow2ch"].indices[Index]] = True
+        self.__refill(Dirty)
+        return self.__output()
+
+    def __match(self, flows):
+        '''Return: Indices of the given requests in the task graph, matched by (src, dst)'''
+        if not isinstance(flows, TaskGraph):
+            flows = list(flows)
+        Key = TaskGraph.requestKeys(flows)
+        Order = np.argsort(self.cache["key"], kind="stable")
+        Sorted = self.cache["key"][Order]
+        # Requests of the same (src, dst) match their occurrences one by one
+        Pos = np.searchsorted(Sorted, Key)
+        Key_order = np.argsort(Key, kind="stable")
+        Pos[Key_order] += np.arange(len(Key)) - np.searchsorted(Key[Key_order], Key[Key_order])
+        if np.any(Pos >= len(Sorted)) or np.any(Sorted[np.minimum(Pos, len(Sorted) - 1)] != Key):
+            raise Exception("Removing requests absent from the task graph: {}".format(flows))
+        return Order[Pos]
+
+    def __output(self):
         ret = [{
-            "G_V": task_arg["G"],
-            "G_R": [(key[0], key[1], val * self.scale) for key, val in self.cache["G_R"].items()],
-            "l": task_arg["l"],
-            "cv_A": task_arg["cv_A"]
+            "G_V": self.task_graph,
+            "G_R": self.task_graph.withVol(self.cache["G_R"] * self.scale),
+            "l": self.task_arg["l"],
+            "cv_A": self.task_arg["cv_A"]
         }]          # we have only one graph now
-        test = [i[-1] for i in ret[0]["G_R"]]
-        print("max injection rate(bits/cycle)", max(test))  #, "details: ", ret[0]["G_R"][index(test(max(test)))])
+        test = ret[0]["G_R"].vol
+        print("max injection rate(bits/cycle)", np.max(test))  #, "details: ", ret[0]["G_R"][index(test(max(test)))])
         # assert max(test) < 1
         return ret
 
     def __setTaskArch(self, task_arg, arch_arg):
-        self.task_graph = task_arg["G"]
+        self.task_arg = task_arg
+        self.task_graph = TaskGraph(task_arg["G"])
         self.arch_arg = arch_arg
-        d = arch_arg["d"]
-        self.cache["vst_cnt"] = np.zeros(4 * d**2 - 4 * d).astype("int16")
-        self.cache["rvs_ptr"] = [[] for i in range(len(self.cache["vst_cnt"]))]
         self.rter = RS.XYRouting(self.arch_arg)
 
     def __forwardPropagation(self):
-        packed_path = self.rter.packedPath(self.task_graph)
-        self.cache["packed_path"] = packed_path
-        vst_cnt = self.cache["vst_cnt"]
-        for sd, path in packed_path.items():
-            channels = [self.rter.rc2c(r, oc) for r, ic, oc in path[: -1]]
-            vst_cnt[channels] += 1
-            rvs_ptr = self.cache["rvs_ptr"]
-            for c in channels:
-                rvs_ptr[c].append(sd)
+        '''Route requests and build the channel-by-flow incidence matrix
+            flow2ch: A (# of channels, # of flows) CSC matrix, column f holds channels passed by flow f
+            ch2flow: The same matrix in CSR format, row c holds flows passing channel c
+            vst_cnt: A (# of channels, ) ndarray, where vst_cnt[c] denotes # of flows passing channel c
+        '''
+        pkt_path = self.rter.path(self.task_graph)
+        Src, Dst = pkt_path.router[pkt_path.offsets[:-1]], pkt_path.router[pkt_path.offsets[1:] - 1]
+        self.cache["key"] = TaskGraph.pairKeys(Src, Dst)
+        passing = pkt_path.channel >= 0      # the last hop leaves through the output port
+        Indptr = np.zeros(len(pkt_path) + 1, dtype=np.int64)
+        np.cumsum(pkt_path.hops() - 1, out=Indptr[1:])
+        self.__setIncidence(pkt_path.channel[passing], Indptr)
+
+    def __setIncidence(self, Channel, Indptr):
+        d = self.arch_arg["d"]
+        flow2ch = sp.csc_matrix((np.ones(len(Channel), dtype=np.int8), Channel, Indptr),
+                                shape=(4 * d**2 - 4 * d, len(Indptr) - 1))
+        self.cache["flow2ch"], self.cache["ch2flow"] = flow2ch, flow2ch.tocsr()
+        self.cache["vst_cnt"] = np.diff(self.cache["ch2flow"].indptr)
 
     def __backwardPropagation(self):
-        packed_path = self.cache["packed_path"]
+        '''Water filling: visit channels from the most crowded, the remaining bandwidth of a channel is shared
+        evenly by flows passing it and not settled yet, which are settled and take their share from every
+        channel they pass
+            settle: A (# of flows, ) ndarray, where settle[f] denotes the channel settling flow f, -1 if none
+            ratio: A (# of flows, ) ndarray, where ratio[f] denotes the share of bandwidth taken by flow f
+        '''
+        flow2ch, ch2flow = self.cache["flow2ch"], self.cache["ch2flow"]
         vst_cnt = self.cache["vst_cnt"]
-        rvs_ptr = self.cache["rvs_ptr"]
 
-        G_R = {sd: 0 for sd in packed_path}
+        settle = np.full(flow2ch.shape[1], -1)
+        ratio = np.zeros(flow2ch.shape[1])
         remain = np.ones(len(vst_cnt)).astype("float64")
-        for step in range(np.max(vst_cnt), 0, -1):
-            channels = np.where(vst_cnt == step)
-            for ch in list(channels[0]):
-                ratio = remain[ch] / (len(rvs_ptr[ch]) + 1e-10)
-                for sd in rvs_ptr[ch]:
-                    G_R[sd] = ratio * self.arch_arg["w"] * self.arch_arg["bw"]
-                    passingby = [self.rter.rc2c(r, oc) for r, ic, oc in packed_path[sd][: -1]]
-                    remain[passingby] -= ratio
-                    for c in passingby:
-                        if c != ch:      # To avoid removing items from the list we're iterating now
-                            rvs_ptr[c].remove(sd)
-                rvs_ptr[ch].clear()
-
-        self.cache["G_R"] = G_R
+        Order = np.lexsort((np.arange(len(vst_cnt)), -vst_cnt))
+        for ch in Order[:np.count_nonzero(vst_cnt)].tolist():
+            Flow = ch2flow.indices[ch2flow.indptr[ch]: ch2flow.indptr[ch + 1]]
+            Flow = Flow[settle[Flow] < 0]
+            if len(Flow) == 0:
+                continue
+            settle[Flow], ratio[Flow] = ch, remain[ch] / (len(Flow) + 1e-10)
+            Passing, _ = expandRanges(flow2ch.indptr[Flow], flow2ch.indptr[Flow + 1])
+            np.subtract.at(remain, flow2ch.indices[Passing], ratio[Flow[0]])
+
+        self.cache["settle"], self.cache["ratio"] = settle, ratio
+        self.cache["G_R"] = ratio * self.arch_arg["w"] * self.arch_arg["bw"]
+
+    def __refill(self, Dirty):
+        '''Water filling again after the incidence is changed, where only dirty channels and channels passed by
+        flows whose share has changed are visited
+        A channel gives the same result as the last filling if its flows are the same, and each of them is
+        settled by the same channel before it (or not) with the same share, so the remaining bandwidth of a
+        visited channel is derived from shares of its settled flows, instead of being tracked for all channels.
+        Shares are subtracted in the order they are settled, the same as __backwardPropagation.
+            Dirty: A (# of channels, ) bool ndarray of channels whose flows have changed, and channels passed by
+                flows settled by them in the last filling
+        Fall back to a full filling once more than half of channels are to be visited.
+        '''
+        flow2ch, ch2flow = self.cache["flow2ch"], self.cache["ch2flow"]
+        vst_cnt, settle, ratio = self.cache["vst_cnt"], self.cache["settle"], self.cache["ratio"]
+
+        Order = np.lexsort((np.arange(len(vst_cnt)), -vst_cnt))[:np.count_nonzero(vst_cnt)]
+        Pos = np.full(len(vst_cnt) + 1, len(Order))   # Pos[-1] for unsettled flows
+        Pos[Order] = np.arange(len(Order))
+        Dirty_pos = Dirty[Order]
+        # Visiting a channel here costs more than in a full filling, which is taken if most channels are dirty
+        k, visited = 0, np.count_nonzero(Dirty_pos)
+        while k < len(Order) and Dirty_pos[k:].any():
+            if visited * 2 > len(Order):
+                return self.__backwardPropagation()
+            k += np.argmax(Dirty_pos[k:])
+            ch = Order[k]
+            Flow = ch2flow.indices[ch2flow.indptr[ch]: ch2flow.indptr[ch + 1]]
+            Settled = Pos[settle[Flow]] < k
+            Prior = Flow[Settled][np.argsort(Pos[settle[Flow[Settled]]], kind="stable")]
+            Flow, remain = Flow[~Settled], np.subtract.reduce(np.concatenate(([1.0], ratio[Prior])))
+            if len(Flow) > 0:
+                share = remain / (len(Flow) + 1e-10)
+                Changed = Flow[(settle[Flow] != ch) | (ratio[Flow] != share)]
+                settle[Changed], ratio[Changed] = ch, share
+                Passing, _ = expandRanges(flow2ch.indptr[Changed], flow2ch.indptr[Changed + 1])
+                Newly = Pos[flow2ch.indices[Passing]]
+                Newly = Newly[(Newly > k) & ~Dirty_pos[Newly]]
+                Dirty_pos[Newly] = True
+                visited += len(np.unique(Newly))
+            k += 1
+
+        self.cache["G_R"] = ratio * self.arch_arg["w"] * self.arch_arg["bw"]
 
 
 if __name__ == "__main__":
@@ -13,4 +13,4 @@
 import sys
 sys.path.append("..")
 
-__all__ = ["CongManager", "SFCongManager"]
\ No newline at end of file
+__all__ = ["CongManager", "SFCongManager", "MMFCongManager"]
\ No newline at end of file
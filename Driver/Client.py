@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import http.client
+from urllib.parse import urlencode
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(root + "/Driver")
+sys.path.append(root + "/Estimator")
+sys.path.append(root + "/CongManager")
+sys.path.append(root + "/Util")
+sys.path.append(root + "/Default")
+
+from Driver.Server import DFT_SOCKET
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''An HTTP connection over a Unix socket'''
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    '''A client of Driver/Server, a drop-in for Driver.execute of SDriver
+        socket_path: Relative path for the Unix socket of the server
+        port: Port of the server on localhost, used instead of socket_path if given
+    '''
+
+    def __init__(self, socket_path=None, port=None):
+        print("log: Employ SDriver client.")
+        self.socket_path = root + "/" + (socket_path or DFT_SOCKET)
+        self.port = port
+
+    def evaluate(self, task_graph_path, usr_config_path, arch_config_path):
+        '''Estimate the task graph file (text or binary, see Util/GraphIO) by the server
+            Return: The result of Session.evaluate, where arrays of sub-tasks are lists
+        '''
+        with open(root + "/" + task_graph_path, "rb") as f:
+            body = f.read()
+        query = urlencode({"uc": usr_config_path, "ac": arch_config_path})
+        conn = self.__connect()
+        try:
+            conn.request("POST", "/evaluate?" + query, body=body,
+                         headers={"Content-Type": "application/octet-stream", "Connection": "close"})
+            response = conn.getresponse()
+            ret = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise Exception("Server error {}: {}".format(response.status, ret.decode(errors="replace")))
+        return json.loads(ret)
+
+    def execute(self, task_graph_path, usr_config_path, arch_config_path, should_print):
+        '''The same as Driver.execute, but estimated by the server
+            Return: Overall time, the sum of the longest latency of requests of every sub-task
+        '''
+        if not task_graph_path:
+            with open(root + "/" + usr_config_path, "r") as f:
+                task_graph_path = json.load(f)["task_arg"]["path"]
+        ret = self.evaluate(task_graph_path, usr_config_path, arch_config_path)
+        if should_print:
+            for task in ret["sub_tasks"]:
+                inject_latency, transmission_latency, latency = (np.array(task[k], dtype=float) for k in
+                                                                 ["inject_latency", "transmission_latency", "latency"])
+                inject_ratio = inject_latency / (latency - inject_latency)
+                max_idx = int(np.argmax(latency))
+                print("\n -------------------- Estimation Result -----------------------\n")
+                print("     Injection Time: {} ...".format(inject_latency[:5].tolist()))
+                print("     Tansmission Time: {} ...".format(transmission_latency[:5].tolist()))
+                print("     Overall Time: {}, ratio of injection time: {}, injection time: {}, transmission time: {}"
+                    .format(latency[max_idx], inject_ratio[max_idx], inject_latency[max_idx], transmission_latency[max_idx]))
+        return ret["latency"]
+
+    def available(self):
+        '''Return: Whether the server answers'''
+        conn = self.__connect(timeout=1)
+        try:
+            conn.request("GET", "/stats")
+            return conn.getresponse().status == 200
+        except OSError:
+            return False
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+    def __connect(self, timeout=None):
+        if self.port is not None:
+            return http.client.HTTPConnection("127.0.0.1", self.port, timeout=timeout)
+        return UnixHTTPConnection(self.socket_path, timeout=timeout)
+
+
+if __name__ == "__main__":
+    os.chdir(root)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", help="Relative path for task graph e.g. Data/sample.txt")
+    parser.add_argument("-uc", help="Relative path for user configuration file e.g. Configuration/baseline.json")
+    parser.add_argument("-ac", help="Relative path for architecture configuration, e.g. Default/dft_task.json")
+    parser.add_argument("-s", "--socket", help="Relative path for the Unix socket of the server, {} by default"
+                        .format(DFT_SOCKET))
+    parser.add_argument("-p", "--port", help="Port of the server on localhost, instead of a Unix socket", type=int)
+    args = parser.parse_args()
+    driver = Client(args.socket, args.port)
+    if not driver.available():
+        print("Warn: No estimation server found, estimate in this process instead")
+        from Driver.SDriver import Driver
+        driver = Driver()
+    driver.execute(args.i, args.uc, args.ac, True)
+    driver.close()
@@ -3,6 +3,8 @@ import os
 import importlib
 import argparse
 import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root)
@@ -12,6 +14,39 @@ sys.path.append(root + "/CongManager")
 sys.path.append(root + "/Util")
 sys.path.append(root + "/Default")
 
+from Util.XYRouting import XYRouting
+from Util.TaskGraph import TaskGraph
+from Util import GraphIO
+from Util.ResultCache import ResultCache
+
+
+def workerInit(prj_arg):
+    '''Set up the estimator owned by a worker process of Driver'''
+    global worker_estimator
+    est_module = importlib.import_module("Estimator." + prj_arg["Estimator"])
+    worker_estimator = est_module.__getattribute__(prj_arg["Estimator"])()
+    ResultCache.attachTo(worker_estimator, prj_arg, root)
+
+
+def workerCalLatency(task, arch_arg):
+    return worker_estimator.calLatency(task, arch_arg)
+
+
+def subTaskLatency(task, transmission_latency):
+    '''Combine injection and transmission time of requests of a sub-task given by a congestion manager
+        transmission_latency: Estimated transmission latency of packets of requests of task["G_R"]
+        Return:
+            inject_latency, transmission_latency, latency: (m, ) ndarrays of time spent on injecting all packets,
+                transmitting them and their sum, of each request
+    '''
+    G_V, G_R = TaskGraph(task["G_V"]), TaskGraph(task["G_R"])
+    inject_latency = G_V.vol / G_R.vol
+    transmission_latency = G_V.vol / task["l"] * np.asarray(transmission_latency, dtype=float)
+    if not np.all(transmission_latency > 0):
+        print(transmission_latency.tolist())
+        raise Exception("Negative transmission latency occurs!!!")
+    return inject_latency, transmission_latency, inject_latency + transmission_latency
+
 
 class Driver():
 
@@ -21,49 +56,77 @@ class Driver():
     def execute_mem(self, task_graph, usr_config_path, arch_config_path, should_print):
         if not hasattr(self, "arch_arg"):
             self.__loadConfigs(usr_config_path, arch_config_path)
-        self.task_arg["G"] = task_graph
+        self.task_arg["G"] = TaskGraph(task_graph)
         self.__rectangle2Square()
-        self.__loadClass()
-        ret = self.do_execution(should_print)
-        self.__resetArch()
+        try:
+            self.__loadClass()
+            ret = self.do_execution(should_print)
+        finally:
+            self.__resetArch()      # execute_mem may be called again after a failure
         return ret
 
     def execute(self, task_graph_path, usr_config_path, arch_config_path, should_print):
         self.__loadConfigs(usr_config_path, arch_config_path)
         self.__loadTaskGraph(task_graph_path)
         self.__rectangle2Square()
-        self.__loadClass()
-        ret = self.do_execution(should_print)
-        self.__resetArch()
+        try:
+            self.__loadClass()
+            ret = self.do_execution(should_print)
+        finally:
+            self.__resetArch()      # the driver may be reused after a failure
         return ret
 
     def do_execution(self, should_print):
         sub_tasks = self.cong_manager.doInjection(self.task_arg, self.arch_arg)
         total_latency = 0
-        for task in sub_tasks:
+        for task, transmission_latency in zip(sub_tasks, self.__calLatencies(sub_tasks)):
             # task lasting time
             # width = self.arch_arg["w"] * self.arch_arg["bw"]
-            inject_latency = [req_v[2] / req_r[2] for req_v, req_r in zip(task["G_V"], task["G_R"])]
-            transmission_latency = self.estimator.calLatency(task, self.arch_arg)
-            print("max packet latency: ", max(transmission_latency))
-            transmission_latency = [req_v[2] / task["l"] * trs_latency for req_v, trs_latency in zip(task["G_V"], transmission_latency)]
-            latency = [i + j for i, j in zip(inject_latency, transmission_latency)]
+            if should_print:
+                print("max packet latency: ", np.max(transmission_latency))
+            inject_latency, transmission_latency, latency = subTaskLatency(task, transmission_latency)
             # latency = transmission_latency
-            inject_ratio = [i / (j - i) for i, j in zip(inject_latency, latency)]
-            if False in [i > 0 for i in transmission_latency]:
-                print(transmission_latency)
-                raise Exception("Negative transmission latency occurs!!!")
-            max_idx = latency.index(max(latency))
+            inject_ratio = inject_latency / (latency - inject_latency)
+            max_idx = int(np.argmax(latency))
+            total_latency += latency[max_idx]
             if should_print:
                 print("\n -------------------- Estimation Result -----------------------\n")
                 # print("     Injection task: ", task)
-                print("     Injection Time: {} ...".format(inject_latency[:5]))
-                print("     Tansmission Time: {} ...".format(transmission_latency[:5]))
+                print("     Injection Time: {} ...".format(inject_latency[:5].tolist()))
+                print("     Tansmission Time: {} ...".format(transmission_latency[:5].tolist()))
                 print("     Overall Time: {}, ratio of injection time: {}, injection time: {}, transmission time: {}"
                     .format(latency[max_idx], inject_ratio[max_idx], inject_latency[max_idx], transmission_latency[max_idx]))
-                total_latency += latency[max_idx]
         return total_latency
 
+    def close(self):
+        '''Shut down worker processes, if any'''
+        if getattr(self, "pool", None) is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __calLatencies(self, sub_tasks):
+        '''Estimate transmission latency of sub-tasks, which are independent, by a pool of prj_arg["workers"]
+        processes (serially by default, "auto" for all cores)
+            Return: An iterable of latency lists of sub-tasks, in the same order
+        '''
+        workers = self.usr_config["prj_arg"].get("workers", 1)
+        workers = os.cpu_count() if workers == "auto" else int(workers)
+        if workers <= 1 or len(sub_tasks) <= 1:
+            return (self.estimator.calLatency(task, self.arch_arg) for task in sub_tasks)
+
+        # Build the route table once, workers memory-map the same files instead of routing by themselves
+        XYRouting(self.arch_arg).routeTable()
+        prj_arg = self.usr_config["prj_arg"]
+        pool_arg = (prj_arg["Estimator"], prj_arg.get("result_cache_dir"), prj_arg.get("result_cache_bytes"), workers)
+        if getattr(self, "pool", None) is None or self.pool_arg != pool_arg:
+            self.close()
+            self.pool = ProcessPoolExecutor(workers, initializer=workerInit, initargs=(prj_arg, ))
+            self.pool_arg = pool_arg
+        # Largest sub-tasks go first for a balanced load
+        order = sorted(range(len(sub_tasks)), key=lambda i: -len(sub_tasks[i]["G_R"]))
+        futures = {i: self.pool.submit(workerCalLatency, sub_tasks[i], self.arch_arg) for i in order}
+        return (futures[i].result() for i in range(len(sub_tasks)))
+
     def __loadClass(self):
         # load classes estimator and congestion manager
         est_module = importlib.import_module(
@@ -74,19 +137,18 @@ class Driver():
         self.cm_class = cm_module.__getattribute__(self.usr_config["prj_arg"]["CongManager"])
         self.cong_manager = self.cm_class()
         self.estimator = self.est_class()
+        # on-disk tier of the result cache shared by estimators, see Util/ResultCache
+        ResultCache.attachTo(self.estimator, self.usr_config["prj_arg"], root)
 
     def __loadTaskGraph(self, task_graph_path):
         # load communication graph specified by "task_arg.path"
-        task_graph = []
         # passed arguments first
         if task_graph_path == "":
             full_task_graph_path = root + "/" + self.usr_config["task_arg"]["path"]
         else:
             full_task_graph_path = root + "/" + task_graph_path
-        with open(full_task_graph_path, "r") as f:
-            for line in f:
-                task_graph.append(line.split(","))
-        task_graph = [(int(r[0]), int(r[1]), float(r[2])) for r in task_graph]
+        # text or binary (.nocg) graphs, see Util/GraphIO
+        task_graph = GraphIO.loadGraph(full_task_graph_path)[0]
         self.task_arg["G"] = task_graph
 
         # # set task graph assignment
@@ -113,15 +175,14 @@ class Driver():
         '''Transform indices of PEs in rectangle [(d + 1) x d] to squares [(d + 1) x (d + 1)]
         '''
         d, n = self.arch_arg['d'], self.arch_arg['n']
-        task_graph = self.task_arg['G']
+        task_graph = TaskGraph(self.task_arg['G'])
         print("\nLog: Change the shape of PE array, from {} x {} to {} x {}"
               .format(d, d + 1, d + 1, d + 1))
         print("\nWarn: Transform latency estimation is carried out on the {} x {} array"
               .format(d + 1, d + 1))
 
-        def Tf(a):
-            return a + a // d
-        self.task_arg['G'] = [(Tf(req[0]), Tf(req[1]), req[2]) for req in task_graph]
+        self.task_arg['G'] = TaskGraph.fromArrays(task_graph.src + task_graph.src // d,
+                                                  task_graph.dst + task_graph.dst // d, task_graph.vol)
         self.arch_arg['d'] = d + 1
         self.arch_arg['n'] = (d + 1)**2
         return task_graph, d, n
@@ -140,3 +201,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
     driver = Driver()
     driver.execute(args.i, args.uc, args.ac, True)
+    driver.close()
@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import signal
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(root + "/Driver")
+sys.path.append(root + "/Estimator")
+sys.path.append(root + "/CongManager")
+sys.path.append(root + "/Util")
+sys.path.append(root + "/Default")
+
+from Util import GraphIO
+from Driver.Session import Session
+
+DFT_SOCKET = "Temp/server.sock"
+DFT_USR_CONFIG = "Configuration/baseline.json"
+DFT_ARCH_CONFIG = "Default/dft_arch.json"
+CONFIG_DIRS = ["Configuration", "Default"]
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+def workerEvaluate(usr_config_path, arch_config_path, task_graph):
+    '''Evaluate a task graph by the session of the worker process for the given configurations
+        Return: The result of Session.evaluate encoded as JSON, where arrays are lists
+    '''
+    global worker_sessions
+    if "worker_sessions" not in globals():
+        worker_sessions = {}
+    key = (usr_config_path, arch_config_path)
+    if key not in worker_sessions:
+        worker_sessions[key] = Session(usr_config_path, arch_config_path)
+    ret = worker_sessions[key].evaluate(task_graph)
+    ret["sub_tasks"] = [{
+        "src": task["G"].src.tolist(), "dst": task["G"].dst.tolist(), "vol": task["G"].vol.tolist(),
+        "inject_latency": task["inject_latency"].tolist(),
+        "transmission_latency": task["transmission_latency"].tolist(),
+        "latency": task["latency"].tolist()
+    } for task in ret["sub_tasks"]]
+    return json.dumps(ret).encode()
+
+
+class Server:
+    '''A long-running estimation server keeping sessions warm between requests
+    Requests are HTTP/1.1 over a Unix socket or a TCP port of localhost, accepted by asyncio and computed by
+    a pool of worker processes, each of which keeps a Session (with its route table and result cache) per
+    pair of configurations.
+        POST /evaluate?uc=<usr config>&ac=<arch config>: The body is a task graph, binary or CSV, see
+            Util/GraphIO; the response is the JSON of Session.evaluate with arrays as lists
+        GET /stats: # of served and failed requests, in JSON
+    Configuration paths are relative to the root directory, the same as SDriver, and must be in one of CONFIG_DIRS.
+    Malformed requests are answered by 400, while failures of estimation are answered by 500 and counted.
+    '''
+
+    def __init__(self, workers=1):
+        print("log: Employ estimation server with {} workers.".format(workers))
+        self.pool = ProcessPoolExecutor(workers)
+        self.served, self.failed = 0, 0
+
+    async def serve(self, socket_path=None, port=None):
+        '''Serve until SIGINT or SIGTERM, on socket_path (relative to the root directory) or localhost:port'''
+        if port is None:
+            socket_path = root + "/" + (socket_path or DFT_SOCKET)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.__handle, path=socket_path)
+            print("log: Listening on {}".format(socket_path))
+        else:
+            server = await asyncio.start_server(self.__handle, host="127.0.0.1", port=port)
+            print("log: Listening on http://127.0.0.1:{}".format(port))
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(sig, stop.set)
+        async with server:
+            await stop.wait()
+        self.pool.shutdown()
+        if port is None and os.path.exists(socket_path):
+            os.remove(socket_path)
+        print("log: Server stopped, {} requests served, {} failed".format(self.served, self.failed))
+
+    async def __handle(self, reader, writer):
+        future = None
+        try:
+            method, path, query, body = await self.__readRequest(reader)
+            if method == "POST" and path == "/evaluate":
+                usr_config_path = self.__configPath(query.get("uc", DFT_USR_CONFIG))
+                arch_config_path = self.__configPath(query.get("ac", DFT_ARCH_CONFIG))
+                task_graph = self.__loadTaskGraph(body)
+                future = asyncio.get_running_loop().run_in_executor(
+                    self.pool, workerEvaluate, usr_config_path, arch_config_path, task_graph)
+            elif method == "GET" and path == "/stats":
+                status, ret = 200, json.dumps({"served": self.served, "failed": self.failed}).encode()
+            else:
+                status, ret = 404, "No such endpoint: {} {}".format(method, path).encode()
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, ret = 400, "Malformed request: {}".format(e).encode()
+        if future is not None:
+            try:
+                status, ret = 200, await future
+                self.served += 1
+            except Exception as e:
+                print("Warn: Failed to serve a request: {}".format(e))
+                self.failed += 1
+                status, ret = 500, str(e).encode()
+        content_type = "application/json" if status == 200 else "text/plain"
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status, REASONS[status], content_type, len(ret)).encode() + ret)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def __readRequest(self, reader):
+        '''Return: method, path, query (the last value of each key) and body of an HTTP request'''
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise ValueError("invalid request line {}".format(request_line))
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        url = urlsplit(request_line[1])
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return request_line[0], url.path, query, body
+
+    def __loadTaskGraph(self, body):
+        '''Return: The task graph given by the body, a binary or text graph file, see Util/GraphIO.loadBytes'''
+        try:
+            return GraphIO.loadBytes(body)[0]
+        except Exception as e:
+            raise ValueError(e)
+
+    def __configPath(self, config_path):
+        '''Return: config_path normalized, which must be a file in one of CONFIG_DIRS under the root directory'''
+        full_config_path = os.path.realpath(os.path.join(root, config_path))
+        for config_dir in CONFIG_DIRS:
+            full_config_dir = os.path.realpath(os.path.join(root, config_dir))
+            if os.path.commonpath([full_config_path, full_config_dir]) == full_config_dir \
+                    and os.path.isfile(full_config_path):
+                return os.path.relpath(full_config_path, root)
+        raise ValueError("configuration {} is not a file in {}".format(config_path, " or ".join(CONFIG_DIRS)))
+
+
+if __name__ == "__main__":
+    os.chdir(root)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--socket", help="Relative path for the Unix socket, {} by default".format(DFT_SOCKET))
+    parser.add_argument("-p", "--port", type=int, help="Listen on localhost:port instead of a Unix socket")
+    parser.add_argument("-w", "--workers", default="1", help="# of worker processes, \"auto\" for all cores")
+    args = parser.parse_args()
+    workers = os.cpu_count() if args.workers == "auto" else int(args.workers)
+    asyncio.run(Server(workers).serve(args.socket, args.port))
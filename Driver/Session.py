@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import asyncio
+import importlib
+import threading
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(root + "/Driver")
+sys.path.append(root + "/Estimator")
+sys.path.append(root + "/CongManager")
+sys.path.append(root + "/Util")
+sys.path.append(root + "/Default")
+
+from Util.XYRouting import XYRouting
+from Util.TaskGraph import TaskGraph
+from Util.ResultCache import ResultCache
+from Driver.SDriver import subTaskLatency
+
+
+class Session:
+    '''A warm estimation session for evaluating many task graphs under the same configurations
+    Configurations are loaded, classes are imported and the route table is built once. Estimators and
+    congestion managers keep state of their last run, so every thread owns its instances (created on its
+    first evaluate), while the result cache and route tables are shared. Nothing of the session is changed
+    by evaluate, which could be called concurrently from a thread pool, or from asyncio by evaluateAsync.
+        usr_config_path, arch_config_path: Relative paths of configuration files, the same as Driver.execute
+    PEs are indexed in the [(d + 1) x d] rectangle of arch_arg, i.e. d x d PEs followed by a row of memory
+    banks, and estimated on the [(d + 1) x (d + 1)] mesh, see Driver.__rectangle2Square.
+    '''
+
+    def __init__(self, usr_config_path, arch_config_path):
+        print("log: Open an estimation session.")
+        with open(root + "/" + usr_config_path, "r") as f:
+            self.usr_config = json.load(f)
+        with open(root + "/" + arch_config_path, "r") as f:
+            self.arch_arg = json.load(f)
+        with open(root + "/Default/dft_task.json", "r") as f:
+            self.task_arg = json.load(f)
+        self.d = self.arch_arg["d"]
+        self.mesh_arg = dict(self.arch_arg, d=self.d + 1, n=(self.d + 1)**2)
+
+        prj_arg = self.usr_config["prj_arg"]
+        self.est_class = getattr(importlib.import_module("Estimator." + prj_arg["Estimator"]), prj_arg["Estimator"])
+        self.cm_class = getattr(importlib.import_module("CongManager." + prj_arg["CongManager"]), prj_arg["CongManager"])
+        ResultCache.attachTo(self.est_class, prj_arg, root)
+        XYRouting(self.mesh_arg).routeTable()
+        self.local = threading.local()
+
+    def evaluate(self, task_graph):
+        '''Estimate latency of a task graph
+            task_graph: A TaskGraph (or a list) of (src, dst, vol) between PEs
+            Return: A dict with items
+                latency: Overall time, the sum of the longest latency of requests of every sub-task
+                sub_tasks: A list of dicts of sub-tasks given by the congestion manager, with items
+                    G: A TaskGraph of requests of the sub-task, with PEs indexed the same as task_graph
+                    inject_latency, transmission_latency, latency: (m, ) ndarrays, see SDriver.subTaskLatency
+        '''
+        cong_manager, estimator = self.__instances()
+        task_graph = TaskGraph(task_graph)
+        d = self.d
+        task_arg = dict(self.task_arg, G=TaskGraph.fromArrays(task_graph.src + task_graph.src // d,
+                                                              task_graph.dst + task_graph.dst // d, task_graph.vol))
+        ret = {"latency": 0.0, "sub_tasks": []}
+        for task in cong_manager.doInjection(task_arg, self.mesh_arg):
+            inject_latency, transmission_latency, latency = subTaskLatency(task, estimator.calLatency(task, self.mesh_arg))
+            G = TaskGraph(task["G_V"])
+            ret["sub_tasks"].append({
+                "G": TaskGraph.fromArrays(G.src - G.src // (d + 1), G.dst - G.dst // (d + 1), G.vol),
+                "inject_latency": inject_latency,
+                "transmission_latency": transmission_latency,
+                "latency": latency
+            })
+            ret["latency"] += float(np.max(latency, initial=0))
+        return ret
+
+    async def evaluateAsync(self, task_graph, executor=None):
+        '''The same as evaluate, run in executor (the default executor of the loop if None)'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.evaluate, task_graph)
+
+    def __instances(self):
+        '''Return: The congestion manager and estimator owned by the calling thread'''
+        local = self.local
+        if not hasattr(local, "estimator"):
+            local.cong_manager, local.estimator = self.cm_class(), self.est_class()
+        return local.cong_manager, local.estimator
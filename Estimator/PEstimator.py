@@ -1,11 +1,14 @@
 import AddPath
+import os
 import copy
+import tempfile
 import numpy as np
-from collections import Counter
 from VirEstimator import VirEstimator
-from Util import XYRouting as RS
-
-PINF = 1e5
+from Util.PathSet import expandRanges
+from Util.ResultCache import ResultCache
+from Util.TaskGraph import TaskGraph
+from Util import GraphIO
+from PreparedTraffic import PreparedTraffic, PINF
 
 
 class PEstimator(VirEstimator):
@@ -15,16 +18,26 @@ class PEstimator(VirEstimator):
                 d: Diameter of the mesh
                 n: d**2, # of routers
             task_config:
-                G_R: A list denoting task graph, whose factors are (src_rt, dst_rt, trans_rate)
+                G_R: A TaskGraph (or a list) of requests, whose factors are (src_rt, dst_rt, trans_rate)
                 cv_A: Coefficiency of the packet size
                 l: Average packet size
+        Options of the solver:
+            compact: Solve output channels passed by any request only, instead of all n * p channels of
+                the mesh, which gives the same result with memory proportional to the traffic
+            dtype: Floating point type of the solver, np.float32 halves the memory of key tensors, where
+                latency stays within a relative error of 1e-4 of np.float64 below saturation
+        Results of calLatency and calLatencyBatch are looked up in result_cache first, which is shared by all
+        instances, set it to None to disable caching.
     '''
     arch_arg = {}
     task_arg = {}
-    cache = {}
+    result_cache = ResultCache()
 
-    def __init__(self):
+    def __init__(self, compact=False, dtype=np.float64):
         print("log: Employed Path-based Estimator")
+        self.compact = compact
+        self.dtype = dtype
+        self.cache = {}             # state of the last solve, owned by the instance
         # Default configuration for on-chip networks
         self.dft_arch = {}
         self.dft_arch["type"] = "mesh"
@@ -55,37 +68,147 @@ class PEstimator(VirEstimator):
         '''
         self.setTask(task_arg)
         self.setArch(arch_arg)
+        if self.result_cache is not None:
+            Time = self.result_cache.lookup(self.task_arg["G_R"], self.__cacheParams(self.task_arg))
+            if Time is not None:
+                self.cache["cached"] = True     # solved on demand by applyDelta
+                return Time.tolist()
+        return self.__solveTask().tolist()
 
-        # set routing strategy
-        self.rter = RS.XYRouting(self.arch_arg)
+    def calLatencyBatch(self, task_args, arch_arg):
+        '''Analyzing latency of B task graphs mapped onto the same mesh in one go
+        Key tensors are stacked with a leading batch axis, e.g. S is (B, n, p) and W is (B, n, p, p),
+        and all task graphs are solved within the same sweep of residual hops.
+            task_args: A list of task_arg, fields absent from a task_arg are taken from self.task_arg
+            Return:
+                Time: A list of B ndarrays, the b-th of which holds estimated transmission latency of
+                    requests expressed by task_args[b]["G_R"]
+        '''
+        self.setArch(arch_arg)
+        tasks = [dict(self.task_arg, **task_arg) for task_arg in task_args]
+        Time = [None] * len(tasks)
+        if self.result_cache is not None:
+            Time = [self.result_cache.lookup(task["G_R"], self.__cacheParams(task)) for task in tasks]
+        Miss = [b for b, T in enumerate(Time) if T is None]
+        if len(Miss) == 0:
+            return Time
+        traffic = PreparedTraffic([tasks[b]["G_R"] for b in Miss], self.arch_arg, self.compact)
+        Solved = self.__solve(traffic, range(len(Miss)), [dict(self.arch_arg, **tasks[b]) for b in Miss])
+        for b, T in zip(Miss, Solved):
+            Time[b] = T
+            if self.result_cache is not None:
+                self.result_cache.store(tasks[b]["G_R"], self.__cacheParams(tasks[b]), T)
+        return Time
 
-        # Preprocess the task graph and set up three key tensors: S, S2, W
-        self.__preprocess()
-        n, p = self.arch_arg["n"], self.arch_arg["p"]
-        S = np.zeros((n, p)) + 1e-10    # for getting rid of dividing zeros
-        S2 = np.zeros((n, p)) + 1e-10
-        W = np.zeros((n, p, p)) + 1e-10
-        # Store them
-        self.cache["S"], self.cache["S2"], self.cache["W"] = S, S2, W
+    def prepare(self, task_arg, arch_arg):
+        '''Run the preprocessing stage only, the returned PreparedTraffic could be solved many times by solve
+        l and cv_A assigned here are taken as defaults of variants.
+        '''
+        self.setTask(task_arg)
+        self.setArch(arch_arg)
+        return PreparedTraffic([self.task_arg["G_R"]], self.arch_arg, self.compact)
 
-        # Initialize S and S2
-        ts, tw = self.arch_arg["ts"], self.arch_arg["tw"]
-        l_, cv_A = self.task_arg["l"], self.task_arg["cv_A"]
-        RH = self.cache["RH"]
-        lb = (l_ - 1) * max(ts, tw)
-        S[RH == 0] = ts + tw + lb
-        S2[RH == 0] = (ts + tw + lb)**2 / (cv_A**2 + 1)
+    def solve(self, traffic, variants):
+        '''Solve prepared traffic of a single task graph against many parameter variants in one sweep
+            traffic: A PreparedTraffic given by prepare
+            variants: A list of V dicts, each of which overrides some of ts, tr, tw, cp_if, cp_of
+                (see arch_arg) and l, cv_A (see task_arg)
+            Return:
+                Time: A (V, m) ndarray, where Time[v] holds estimated transmission latency of requests
+                    with the v-th variant
+        '''
+        if traffic.B != 1:
+            raise Exception("Only traffic of a single task graph could be solved against variants")
+        self.cache.clear()
+        settings = [{**self.arch_arg, **self.task_arg, **variant} for variant in variants]
+        return np.stack(self.__solve(traffic, [0] * len(variants), settings))
 
-        # Initialize W
-        self.__updateRouterBlockingTime(0)
+    def calLatencyStream(self, task_arg, arch_arg, chunk_size=1 << 20):
+        '''Analyzing latency of a task graph too large to be held in memory, in two streaming passes
+        The first pass routes requests chunk by chunk and accumulates cell features (see PreparedTraffic.fromChunks),
+        then the solver runs on cells, and the second pass routes every chunk again to sum its blocking time.
+        Peak memory is bounded by the size of a chunk and n * p * p rather than the graph.
+            task_arg: G_R is the path of a graph file (see Util/GraphIO), a TaskGraph, or an iterable of chunks
+                (TaskGraphs or lists of requests); a one-shot iterator of chunks is spooled to a temporary
+                binary file during the first pass and read back in the second one
+            chunk_size: # of requests per chunk when G_R is a file or a TaskGraph
+            Return:
+                A generator of ndarrays, latency of requests of each chunk in order
+        '''
+        source = task_arg["G_R"]
+        self.setTask({k: v for k, v in task_arg.items() if k != "G_R"})
+        self.setArch(arch_arg)
+        spooled, sizes = None, []
+        if isinstance(source, str):
+            first = second = lambda: GraphIO.iterChunks(source, chunk_size)
+        elif isinstance(source, TaskGraph):
+            first = second = lambda: (source[i: i + chunk_size] for i in range(0, len(source), chunk_size))
+        elif iter(source) is source:
+            fd, spooled = tempfile.mkstemp(suffix=".nocg")
+            os.close(fd)
 
-        # Calculate blocking time of each router
-        max_rh = np.max(RH[RH != PINF])
-        for rh in range(1, max_rh + 1):
-            self.__updateOCServiceTime(rh)
-            self.__updateRouterBlockingTime(rh)
-        Time = self.__analyzePktTime()
-        return Time
+            def first():
+                for chunk in GraphIO.spool(source, spooled):
+                    sizes.append(len(chunk))
+                    yield chunk
+        else:
+            first = second = lambda: iter(source)
+
+        try:
+            traffic = PreparedTraffic.fromChunks(first(), self.arch_arg, self.compact)
+            if spooled is not None:
+                G = GraphIO.loadBinary(spooled)[0]
+                Offsets = np.concatenate(([0], np.cumsum(sizes, dtype=np.int64)))
+                second = lambda: (G[Offsets[i]: Offsets[i + 1]] for i in range(len(sizes)))
+        finally:
+            if spooled is not None:
+                try:
+                    os.remove(spooled)      # the mapping of a loaded graph stays valid
+                except OSError:
+                    pass
+        self.__solve(traffic, [0], [dict(self.arch_arg, **self.task_arg)])
+        return self.__streamPktTime(second())
+
+    def calLoadCurve(self, task_arg, arch_arg, scales):
+        '''Load-latency curve of a task graph, whose request rates are multiplied by each of scales
+        Routes, RH and P_p2p don't depend on the load and L_p2p scales linearly, so the task graph is
+        preprocessed once and all multipliers are solved in one sweep.
+            scales: A list of K injection rate multipliers
+            Return:
+                Time: A (K, m) ndarray, where Time[k] holds estimated transmission latency of requests
+                    with rates multiplied by scales[k]
+                Saturated: A (K, ) bool ndarray, where Saturated[k] indicates the network is saturated,
+                    i.e. some blocking time is non-finite or negative, with rates multiplied by scales[k]
+        '''
+        traffic = self.prepare(task_arg, arch_arg)
+        return self.__solveScales(traffic, scales)
+
+    def findSaturation(self, task_arg, arch_arg, lo=0, hi=1, rtol=1e-3, probes=4, max_iter=64):
+        '''Search the smallest multiplier of request rates that saturates the network
+        The bracket [lo, hi] is doubled until hi saturates, then shrunk by k-section: each round solves
+        probes multipliers evenly spaced inside the bracket in one sweep, so the bracket is narrowed
+        (probes + 1) times per round (probes = 1 is plain bisection). Saturation is assumed monotone in load.
+            lo: A multiplier known to be unsaturated
+            hi: Initial guess of a saturated multiplier
+            rtol: Stop once hi - lo <= rtol * hi
+            Return:
+                lo: The largest multiplier found unsaturated
+                hi: The smallest multiplier found saturated, None if never saturated in max_iter doublings
+        '''
+        traffic = self.prepare(task_arg, arch_arg)
+        for _ in range(max_iter):
+            if self.__solveScales(traffic, [hi])[1][0]:
+                break
+            lo, hi = hi, hi * 2
+        else:
+            return lo, None
+        while hi - lo > rtol * hi:
+            Scale = lo + (hi - lo) * np.arange(1, probes + 1) / (probes + 1)
+            _, Saturated = self.__solveScales(traffic, Scale)
+            k = np.argmax(Saturated) if Saturated.any() else probes
+            lo, hi = (Scale[k - 1] if k > 0 else lo), (Scale[k] if k < probes else hi)
+        print("log: Saturation multiplier in [{}, {}]".format(lo, hi))
+        return lo, hi
 
     def setTask(self, task_arg):
         for arg in task_arg:
@@ -101,146 +224,305 @@ class PEstimator(VirEstimator):
             raise Exception("Invalid hardware configuration: d = {}, n = {}".format(self.arch_arg["d"], self.arch_arg["n"]))
         return self
 
-    def __preprocess(self):
-        '''Preprocess the task graph and extract its features
-        Step 1 & 2 in the article: Calculating P(s->d), L, cv_A, P_p2p, L_p2p, L_p, RH
+    def applyDelta(self, removed_flows, added_flows):
+        '''Re-estimate latency after a few requests of the task graph of the last calLatency are changed
+        Traffic tensors are patched with the changed requests only, and only output channels whose downstream
+        dependency cone is touched are solved again.
+            removed_flows: An iterable of requests (src_rt, dst_rt, ...) to be removed, matched by (src_rt, dst_rt)
+            added_flows: An iterable of requests (src_rt, dst_rt, trans_rate) to be added
             Return:
-                P_s2d: A list with factors' format as (src_rt, dst_rt, ratio), which denotes the proportion of
-                    trasmission volume of the request (src_rt, dst_rt)
-                L: A (n, ) ndarray, where L[i] denotes average injection rate of router i
-                L_p: A (n, p) ndarray, where Lp[i, j] denotes packet arrival rate to the output channel j of router i
-                P_p2p: A (n, p, p) ndarray, where P_p2p[i, j, k] denotes probability of a packet entered
-                    from channel j is routed to channel k in router i
-                L_p2p: A (n, p, p) ndarray, where L_p2p[i, j, k] denotes trasmission rate from channel j to channel k
-                    in router i
-                RH: A (n, p) ndarray, where RH[i, j] denotes the longest residual hops of packets
-                    passing router i output channel j
+                Time: A list of estimated transmission latency of requests of the new task graph, which is kept
+                    in task_arg["G_R"] as the remaining requests in their original order followed by added ones
         '''
+        c = self.cache
+        if c.get("cached"):
+            self.__solveTask()
+        if "W" not in c or len(c["which"]) != 1:
+            raise Exception("applyDelta should follow a calLatency")
+        G, added_flows = TaskGraph(self.task_arg["G_R"]), TaskGraph(added_flows)
+        if not isinstance(removed_flows, TaskGraph):
+            removed_flows = list(removed_flows)
+        Key = TaskGraph.requestKeys(removed_flows)
+        # A (src_rt, dst_rt) pair appears once in the task graph
+        All_key = TaskGraph.requestKeys(G)
+        Order = np.argsort(All_key)
+        Sorted = All_key[Order]
+        Pos = np.minimum(np.searchsorted(Sorted, Key), len(Sorted) - 1)
+        if len(Key) > 0 and (len(Sorted) == 0 or np.any(Sorted[Pos] != Key)):
+            raise Exception("Removing requests absent from the task graph: {}".format(removed_flows))
+        Removed = np.unique(Order[Pos])
+        G = TaskGraph.concat([G.take(np.setdiff1d(np.arange(len(G)), Removed)), added_flows])
+        assert len(np.unique(TaskGraph.requestKeys(G))) == len(G)
+        self.task_arg["G_R"] = G
+
+        # Patch the traffic, then solve channels passed by changed requests and those depending on them again
+        traffic = c["traffic"]
+        Dirty, Moved = traffic.patch(Removed, added_flows.src, added_flows.dst, added_flows.vol)
+        # With a single task graph, cells of the solver are exactly those of the traffic
+        for k in ["S", "S2", "W"]:
+            X = np.full((traffic.K + 1, ) + c[k].shape[1:], 1e-10, dtype=self.dtype)
+            X[Moved] = c[k][:-1]
+            c[k] = X
+        self.__setTraffic(traffic, c["which"])
+        self.__resolve(Dirty)
+        Time = self.__analyzePktTime()[0]
+        if self.result_cache is not None:
+            self.result_cache.store(G, self.__cacheParams(self.task_arg), Time)
+        return Time.tolist()
+
+    def __solveTask(self):
+        '''Return: A ndarray of estimated transmission latency of requests of task_arg["G_R"]'''
+        self.cache.clear()
+        traffic = PreparedTraffic([self.task_arg["G_R"]], self.arch_arg, self.compact)
+        Time = self.__solve(traffic, [0], [dict(self.arch_arg, **self.task_arg)])[0]
+        if self.result_cache is not None:
+            self.result_cache.store(self.task_arg["G_R"], self.__cacheParams(self.task_arg), Time)
+        return Time
+
+    def __cacheParams(self, task_arg):
+        '''Return: Parameters that results depend on besides the task graph, see ResultCache'''
+        return {"estimator": type(self).__name__, "dtype": np.dtype(self.dtype).name,
+                "arch_arg": self.arch_arg, "l": task_arg["l"], "cv_A": task_arg["cv_A"]}
 
-        # Set up P_s2d
-        G = self.task_arg["G_R"]
-        G = [(r[0], r[1], r[2] / self.task_arg["l"]) for r in G]      # bit/cycle -> packet/cycle
-
-        # TODO: a single request for a (source, destination) pair only
-        assert max(Counter([(r[0], r[1]) for r in G]).values()) <= 1
-
-        Vol = np.asarray([r[2] for r in G])
-        P_s2d = Vol / np.sum(Vol)
-
-        # Set up L_p2p, L, RH, pkt_path
-        n, p = self.arch_arg["n"], self.arch_arg["p"]
-        L_p2p = np.zeros((n, p, p))
-        L = np.zeros(n)
-        RH = np.tile(PINF, (n, p)).astype(np.int)
-        pkt_path = self.rter.path(G)
-
-        for request, Path, proportion in zip(G, pkt_path, P_s2d):
-            Router_path, Iport_path, Oport_path = zip(*Path)
-            vol = request[2]
-            L_p2p[Router_path, Iport_path, Oport_path] += vol * proportion
-            L[request[0]] += vol * proportion
-            Residual_hops = np.asarray([i for i in range(len(Oport_path)-1, -1, -1)])
-            RH[Router_path, Oport_path] = np.minimum(RH[Router_path, Oport_path], Residual_hops)
-
-        # Calculate P_p2p
-        L_p2p_t = np.transpose(L_p2p, (1, 0, 2))    # TODO: Transpose should be replaced to optimize the performance
-        L_p = np.sum(L_p2p_t, axis=0)
-        P_p2p_t = L_p2p_t / (L_p + 1e-10)
-        P_p2p = np.transpose(P_p2p_t, (1, 0, 2))
+    def __solveScales(self, traffic, scales):
+        '''Return: Time and Saturated of calLoadCurve, for prepared traffic of a single task graph'''
+        self.cache.clear()
+        settings = [{**self.arch_arg, **self.task_arg, "scale": k} for k in scales]
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            Time = np.stack(self.__solve(traffic, [0] * len(settings), settings, strict=False))
+        c = self.cache
+        # Blocking time of cells with traffic
+        Used = c["RH"][:-1] != PINF
+        Bad = np.any(~np.isfinite(c["W"][:-1]) | (c["W"][:-1] < 0), axis=1) & Used
+        Saturated = np.bincount(c["cell_b"][Bad], minlength=len(settings)) > 0
+        Saturated |= np.any(~np.isfinite(Time) | (Time < 0), axis=1)
+        return Time, Saturated
 
+    def __resolve(self, Dirty):
+        '''Solve cells again in order of residual hops, where only dirty cells and cells pointing to a router
+        with any cell solved again are visited
+            Dirty: A (K, ) bool ndarray of cells whose traffic has changed
+        '''
+        c = self.cache
+        S, S2, W, RH = c["S"], c["S2"], c["W"], c["RH"][:-1]
+        Cell_b, Cell_r, Cell_oc = c["cell_b"], c["cell_r"], c["cell_oc"]
+        Nbr_r, _ = self.rter.neighborTable()
+        Dst_r = Nbr_r[Cell_r, Cell_oc]
+
+        # Cells left without any traffic are back to their initial state
+        Idle = np.nonzero(Dirty & (RH == PINF))[0]
+        S[Idle], S2[Idle], W[Idle] = 1e-10, 1e-10, 1e-10
+        Dirty_rt = np.zeros((len(c["which"]), self.arch_arg["n"]), dtype=bool)
+        Dirty_rt[Cell_b[Dirty], Cell_r[Dirty]] = True
+
+        Active = np.nonzero((RH == 0) & Dirty)[0]
+        self.__initOCServiceTime(Active)
+        self.__updateRouterBlockingTime(0, Active)
+        max_rh = np.max(RH[RH != PINF])
+        for rh in range(1, max_rh + 1):
+            Upstream = (Dst_r >= 0) & Dirty_rt[Cell_b, np.maximum(Dst_r, 0)]
+            Active = np.nonzero((RH == rh) & (Dirty | Upstream))[0]
+            self.__updateOCServiceTime(rh, Active)
+            self.__updateRouterBlockingTime(rh, Active)
+            Dirty_rt[Cell_b[Active], Cell_r[Active]] = True
+
+    def __solve(self, traffic, Which, settings, strict=True):
+        '''Solving stage: estimate latency of requests of prepared traffic
+        Every element of the batch is a task graph of the traffic solved with its own parameters.
+            traffic: A PreparedTraffic
+            Which: A list of B indices, the b-th element of the batch is the Which[b]-th task graph of traffic
+            settings: A list of B dicts assigning ts, tr, tw, cp_if, cp_of, l and cv_A of each element,
+                and optionally scale, a multiplier of request rates (1 by default)
+            strict: Raise on NAN in W, otherwise NAN is kept for the caller to detect saturation
+            Return:
+                Time: A list of B ndarrays, each of which holds estimated transmission latency of requests
+        '''
+        c = self.cache
+        c["param"] = {
+            k: np.asarray([setting[k] for setting in settings], dtype=self.dtype)
+            for k in ["ts", "tr", "tw", "cp_if", "cp_of", "l", "cv_A"]
+        }
+        c["param"]["scale"] = np.asarray([setting.get("scale", 1) for setting in settings], dtype=self.dtype)
+        c["strict"] = strict
+        self.__setTraffic(traffic, np.asarray(Which, dtype=np.int64))
+
+        # Set up three key tensors: S, S2, W
+        K, p = len(c["cell_b"]), self.arch_arg["p"]
+        S = np.full(K + 1, 1e-10, dtype=self.dtype)    # for getting rid of dividing zeros
+        S2 = np.full(K + 1, 1e-10, dtype=self.dtype)
+        W = np.full((K + 1, p), 1e-10, dtype=self.dtype)
         # Store them
+        c["S"], c["S2"], c["W"] = S, S2, W
+
+        # Cells in order of residual hops, those at rh are Order[Level[rh]: Level[rh + 1]]
+        RH = c["RH"][:-1]
+        Order = np.argsort(RH, kind="stable")
+        max_rh = np.max(RH[RH != PINF])
+        Level = np.searchsorted(RH[Order], np.arange(max_rh + 2))
+
+        # Initialize S, S2 and W
+        self.__initOCServiceTime(Order[Level[0]: Level[1]])
+        self.__updateRouterBlockingTime(0, Order[Level[0]: Level[1]])
+
+        # Calculate blocking time of each router
+        for rh in range(1, max_rh + 1):
+            self.__updateOCServiceTime(rh, Order[Level[rh]: Level[rh + 1]])
+            self.__updateRouterBlockingTime(rh, Order[Level[rh]: Level[rh + 1]])
+        if traffic.pkt_path is None:        # requests are streamed, see calLatencyStream
+            return None
+        return self.__analyzePktTime()
+
+    def __setTraffic(self, traffic, Which):
+        '''Gather cells of elements of the batch from prepared traffic
+        Cells of the b-th element are cells of the Which[b]-th task graph of traffic, placed consecutively
+        in order of the batch and followed by a sentinel cell.
+            cell_src: A (K, ) ndarray, where cell_src[c] denotes the cell of traffic that cell c comes from
+            cell_b, cell_r, cell_oc: (K, ) ndarrays, the element, router and output channel of each cell
+            cell_offsets: A (B + 1, ) ndarray, cells of the b-th element are cell_offsets[b]: cell_offsets[b + 1]
+            L_p: A (K + 1, ) ndarray, where L_p[c] denotes packet arrival rate to (the output channel of) cell c
+            P_p2p: A (K + 1, p) ndarray, where P_p2p[c, j] denotes probability of a packet entered
+                from channel j is routed to cell c in its router
+            L_p2p, RH: See PreparedTraffic, with packets per cycle as the unit of rates
+        '''
+        c = self.cache
+        c["traffic"], c["which"] = traffic, Which
+        self.rter = traffic.rter
+        Cell, Cell_b = expandRanges(traffic.cell_offsets[Which], traffic.cell_offsets[Which + 1])
+        c["cell_src"], c["cell_b"] = Cell, Cell_b
+        c["cell_r"], c["cell_oc"] = traffic.cell_r[Cell], traffic.cell_oc[Cell]
+        c["cell_offsets"] = np.concatenate(([0], np.cumsum(np.diff(traffic.cell_offsets)[Which])))
+        Cell = np.append(Cell, traffic.K)                                               # sentinel
+        Unit = np.append(c["param"]["scale"] / c["param"]["l"], 0)[np.append(Cell_b, -1)]   # bit -> packet
+        L_p2p = (traffic.L_p2p[Cell] * Unit[:, np.newaxis]).astype(self.dtype)
+        L_p = np.sum(L_p2p, axis=1)
+        c["L_p2p"], c["L_p"], c["RH"] = L_p2p, L_p, traffic.RH[Cell]
+        c["P_p2p"] = L_p2p / (L_p[:, np.newaxis] + 1e-10)
+
+    def __cellOf(self, Bi, R, OC):
+        '''Return: Cells of output channel OC of router R of elements Bi, the sentinel cell if absent'''
         c = self.cache
-        c["P_s2d"], c["L"], c["L_p"], c["P_p2p"], c["L_p2p"], c["RH"] = P_s2d, L, L_p, P_p2p, L_p2p, RH
-        c["pkt_path"] = pkt_path
+        traffic, Which = c["traffic"], c["which"][Bi]
+        Cell = traffic.cell[Which, R, OC].astype(np.int64)
+        return np.where(Cell == traffic.K, len(c["cell_b"]),
+                        Cell - traffic.cell_offsets[Which] + c["cell_offsets"][Bi])
 
-    def __updateOCServiceTime(self, rh):
+    def __initOCServiceTime(self, Active):
+        '''Initialize S and S2 of cells at the last hop, given by indices Active'''
+        S, S2, prm = self.cache["S"], self.cache["S2"], self.cache["param"]
+        ts, tw = prm["ts"], prm["tw"]
+        lb = (prm["l"] - 1) * np.maximum(ts, tw)
+        Bi = self.cache["cell_b"][Active]
+        S[Active] = (ts + tw + lb)[Bi]
+        S2[Active] = ((ts + tw + lb)**2 / (prm["cv_A"]**2 + 1))[Bi]
+
+    def __updateOCServiceTime(self, rh, Active):
         '''Update s_i^M and s_i^M^2
         Formula 16
-            S: A (n, p) ndarray, where S[i, j] dentoes the first moment of
-                service time of output channel j of router i
-            S2: A (n, p) ndarray, where S[i, j] dentoes the second moment of
-                service time of output channel j of router i
-            W: A (n, p, p) ndarray, where W[i, j, k] denotes bloking time spent on queuing from
-                input channel j to output channel k in router i
-            P_p2p: A (n, p, p) ndarray, where P_p2p[i, j, k] denotes probability of a packet entered
-                    from channel j is routed to channel k in router i
-            RH: A (n, p) ndarray, where RH[i, j] indicates the longest residual hops of packets
-                    passing router i output channel j
+            S: A (K + 1, ) ndarray, where S[c] dentoes the first moment of service time of cell c
+            S2: A (K + 1, ) ndarray, where S2[c] dentoes the second moment of service time of cell c
+            W: A (K + 1, p) ndarray, where W[c, j] denotes bloking time spent on queuing from
+                input channel j to cell c in its router
+            P_p2p: A (K + 1, p) ndarray, where P_p2p[c, j] denotes probability of a packet entered
+                    from channel j is routed to cell c in its router
+            RH: A (K + 1, ) ndarray, where RH[c] indicates the longest residual hops of packets passing cell c
             rh: The present residual hop (step) we are working on
+            Active: Indices of cells to update
         '''
         assert rh > 0
-        ts, tr, tw = self.arch_arg["ts"], self.arch_arg["tr"], self.arch_arg["tw"]
-        cp_if, cp_of = self.arch_arg["cp_if"], self.arch_arg["cp_of"]
-        n, p = self.arch_arg["n"], self.arch_arg["p"]
-        S, S2, W = self.cache["S"], self.cache["S2"], self.cache["W"]
-        P_p2p, RH = self.cache["P_p2p"], self.cache["RH"]
-
-        Upd_s = np.zeros((n, p))
-        Upd_s2 = np.zeros((n, p))
-        R, C = np.where(RH == rh)
-        for r, c in zip(R, C):
-            dst_r, dst_ic = self.rter.pointTo(r, c)
-            for dst_oc in range(6):
-                latency = ts + tr + tw
-                latency += W[dst_r, dst_ic, dst_oc]
-                latency += S[dst_r, dst_oc]
-                latency -= max(ts, tw) * (cp_if + cp_of)
-                latency = max(latency, 0)
-                Upd_s[r, c] += P_p2p[dst_r, dst_ic, dst_oc] * latency
-                Upd_s2[r, c] += P_p2p[dst_r, dst_ic, dst_oc] * latency**2
-        S += Upd_s
-        S2 += Upd_s2
-
-    def __updateRouterBlockingTime(self, rh):
+        c = self.cache
+        S, S2, W, P_p2p, RH, prm = c["S"], c["S2"], c["W"], c["P_p2p"], c["RH"], c["param"]
+        Nbr_r, Nbr_ic = self.rter.neighborTable()
+
+        # Solve the whole level at once: gather cells of the downstream router of every active cell
+        Bi, R, C = c["cell_b"][Active], c["cell_r"][Active], c["cell_oc"][Active]
+        ts, tr, tw = prm["ts"][Bi, np.newaxis], prm["tr"][Bi, np.newaxis], prm["tw"][Bi, np.newaxis]
+        cp_if, cp_of = prm["cp_if"][Bi, np.newaxis], prm["cp_of"][Bi, np.newaxis]
+        Dst_r, Dst_ic = Nbr_r[R, C], Nbr_ic[R, C]
+        if np.any(Dst_r < 0):
+            i = np.argmax(Dst_r < 0)
+            raise Exception("Invalid output port: router = {}, oc = {}".format(R[i], C[i]))
+        Dst = self.__cellOf(Bi[:, np.newaxis], Dst_r[:, np.newaxis], np.arange(self.arch_arg["p"]))
+        Dst_ic = Dst_ic[:, np.newaxis]
+        # Downstream cells at this residual hop or farther aren't solved yet in a full sweep, keep them
+        # initial so that solving a level again (see applyDelta) gives the same result
+        Unsolved = RH[Dst] >= rh
+        W_dst = np.where(Unsolved, 1e-10, W[Dst, Dst_ic])
+        S_dst = np.where(Unsolved, 1e-10, S[Dst])
+        Latency = ts + tr + tw + W_dst + S_dst - np.maximum(ts, tw) * (cp_if + cp_of)
+        Latency = np.maximum(Latency, 0)
+        Prob = P_p2p[Dst, Dst_ic]
+        S[Active] = 1e-10 + np.sum(Prob * Latency, axis=1)
+        S2[Active] = 1e-10 + np.sum(Prob * Latency**2, axis=1)
+
+    def __updateRouterBlockingTime(self, rh, Active):
         '''Update W
         Formula 13
-            W: A (n, p, p) ndarray, where W[i, j, k] denotes bloking time spent on queuing from
-                input channel j to output channel k in router i
-            S: A (n, p) ndarray, where S[i, j] dentoes the first moment of service time of
-                output channel j of router i
-            S2: A (n, p) ndarray, where S[i, j] dentoes the second moment of service time of
-                output channel j of router i
-            L_p: A (n, p) ndarray, where Lp[i, j] denotes packet arrival rate to the
-                output channel j of router
-            L_p2p: A (n, p, p) ndarray, where L_p2p[i, j, k] denotes trasmission rate from
-                channel j to channel k in router i
-            RH: A (n, p) ndarray, where RH[i, j] indicates the longest residual hops of packets
-                passing router i output channel j
+            W: A (K + 1, p) ndarray, where W[c, j] denotes bloking time spent on queuing from
+                input channel j to cell c in its router
+            S: A (K + 1, ) ndarray, where S[c] dentoes the first moment of service time of cell c
+            S2: A (K + 1, ) ndarray, where S2[c] dentoes the second moment of service time of cell c
+            L_p: A (K + 1, ) ndarray, where L_p[c] denotes packet arrival rate to cell c
+            L_p2p: A (K + 1, p) ndarray, where L_p2p[c, j] denotes trasmission rate from
+                channel j to cell c in its router
             rh: The present residual hop (step) we are working on
+            Active: Indices of cells to update
         '''
         S, S2, W = self.cache["S"], self.cache["S2"], self.cache["W"]
-        L_p, L_p2p, RH = self.cache["L_p"], self.cache["L_p2p"], self.cache["RH"]
-
-        lr, lc = np.where(RH == rh)
-        for r, oc in zip(lr, lc):
-            p = self.arch_arg["p"]
-            L = np.asarray([np.sum(L_p2p[r, :i, oc]) for i in range(p)])
-            L[0] = L_p2p[r, 0, oc]                  # input channel
-            Service_rate = 1 / S[r, oc]
-            L[1:] = 2 * (Service_rate - L[1:])**2
-            L[0] = 2 * (Service_rate - L[0])        # input channel
-            arrival_rate = L_p[r, oc]
-            ca2 = self.task_arg["cv_A"]**2
-            cs2 = S2[r, oc] / S[r, oc]**2 - 1
-            L = arrival_rate * (ca2 + cs2) / L
-            L[0] = L[0] / Service_rate              # input channel
-            W[r, :, oc] = L
-
-        if np.nan in W:
+        L_p, L_p2p = self.cache["L_p"], self.cache["L_p2p"]
+
+        Bi = self.cache["cell_b"][Active]
+        # L[:, i] = sum(L_p2p[c, :i]), the traffic of higher-priority input channels
+        L = np.cumsum(L_p2p[Active], axis=1)
+        L[:, 1:] = L[:, :-1]
+        L[:, 0] = L_p2p[Active, 0]                      # input channel
+        Service_rate = (1 / S[Active])[:, np.newaxis]
+        L[:, 1:] = 2 * (Service_rate - L[:, 1:])**2
+        L[:, :1] = 2 * (Service_rate - L[:, :1])        # input channel
+        arrival_rate = L_p[Active][:, np.newaxis]
+        ca2 = (self.cache["param"]["cv_A"]**2)[Bi, np.newaxis]
+        cs2 = (S2[Active] / S[Active]**2 - 1)[:, np.newaxis]
+        L = arrival_rate * (ca2 + cs2) / L
+        L[:, :1] = L[:, :1] / Service_rate              # input channel
+        W[Active] = L
+
+        if self.cache["strict"] and np.isnan(L).any():
             raise Exception("NAN in W: rh = {}".format(rh))
 
     def __analyzePktTime(self):
-        l_ = self.task_arg["l"]
-        ts, tw, tr = self.arch_arg["ts"], self.arch_arg["tw"], self.arch_arg["tr"]
-        W, Path = self.cache["W"], self.cache["pkt_path"]
-        lb = max(ts, tw) * (l_ - 1)
-        Time = []
-        for path in Path:
-            time = lb
-            for r, ic, oc in path:
-                time += tr + W[r, ic, oc] + ts + tw
-            Time.append(time)
-        return Time
+        '''Return: A list of B ndarrays holding latency of requests of each element of the batch'''
+        c = self.cache
+        traffic, Which, prm, W = c["traffic"], c["which"], c["param"], c["W"]
+        Path = traffic.pkt_path
+        # Requests and hops of the task graph of each element
+        Flow, Flow_b = expandRanges(traffic.offsets[Which], traffic.offsets[Which + 1])
+        Hop_first, Hop_end = Path.offsets[traffic.offsets[Which]], Path.offsets[traffic.offsets[Which + 1]]
+        Hop, Hop_b = expandRanges(Hop_first, Hop_end)
+        Cell = traffic.hop_cell[Hop] - traffic.cell_offsets[Which[Hop_b]] + c["cell_offsets"][Hop_b]
+        Hop_time = prm["tr"][Hop_b] + W[Cell, Path.ic[Hop]] + prm["ts"][Hop_b] + prm["tw"][Hop_b]
+        # Position of the first hop of each request in Hop_time
+        Begin = np.cumsum(Hop_end - Hop_first) - (Hop_end - Hop_first)
+        First = Begin[Flow_b] + Path.offsets[Flow] - Hop_first[Flow_b]
+        lb = np.maximum(prm["ts"], prm["tw"]) * (prm["l"] - 1)
+        Time = lb[Flow_b] + np.add.reduceat(Hop_time, First)
+        return np.split(Time, np.cumsum(traffic.offsets[Which + 1] - traffic.offsets[Which])[:-1])
+
+    def __streamPktTime(self, chunks):
+        '''Return: A generator of latency of requests of each chunk of streamed traffic, see calLatencyStream'''
+        c = self.cache
+        traffic, prm, W = c["traffic"], c["param"], c["W"]     # kept even if the cache is reset meanwhile
+        lb = (np.maximum(prm["ts"], prm["tw"]) * (prm["l"] - 1))[0]
+
+        def pktTime():
+            for chunk in chunks:
+                chunk = TaskGraph(chunk)
+                if len(chunk) == 0:
+                    yield np.zeros(0, dtype=W.dtype)
+                    continue
+                Path = traffic.rter.route(chunk.src.astype(np.int64), chunk.dst.astype(np.int64))
+                Cell = traffic.cell[0, Path.router, Path.oc]
+                Hop_time = prm["tr"][0] + W[Cell, Path.ic] + prm["ts"][0] + prm["tw"][0]
+                yield lb + np.add.reduceat(Hop_time, Path.offsets[:-1])
+        return pktTime()
 
 
 if __name__ == "__main__":
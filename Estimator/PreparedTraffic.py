@@ -0,0 +1,181 @@
+import AddPath
+import numpy as np
+from Util import XYRouting as RS
+from Util.PathSet import PathSet
+from Util.TaskGraph import TaskGraph
+
+PINF = 1e5
+
+
+class PreparedTraffic:
+    ''' Preprocessing stage of PEstimator: features of task graphs routed on a mesh
+        Step 1 & 2 in the article depend on request rates and the mesh only, so a PreparedTraffic could be
+        built once and solved against many variants of router and packet parameters (see PEstimator.solve).
+        Rates are kept in bits per cycle, i.e. as if l = 1, since L, L_p2p and L_p scale with 1 / l.
+        Features of output channels are stored per cell, where a cell is an output channel (b, i, j), i.e.
+        channel j of router i in the b-th task graph. Cells are ordered by the key (b * n + i) * p + j, and a
+        sentinel cell K without any traffic follows them, so that gathering an absent cell is harmless.
+        Initialize class with:
+            graphs: A list of B task graphs (TaskGraphs or lists), whose factors are (src_rt, dst_rt, trans_rate)
+            arch_arg: Architecture configuration, where d, n and p are used
+            compact: Keep cells passed by any request only, instead of all B * n * p output channels
+        Fields:
+            m: The number of requests of all task graphs
+            Graph: A (m, ) ndarray, where Graph[i] denotes the task graph that request i belongs to
+            offsets: A (B + 1, ) ndarray, requests of the b-th task graph are offsets[b]: offsets[b + 1]
+            Src, Dst, Vol: (m, ) ndarrays of sources, destinations and rates of requests
+            P_s2d: A (m, ) ndarray, where P_s2d[i] denotes the proportion of trasmission volume of
+                request i in its task graph
+            pkt_path: A PathSet holding routed paths of requests
+            L: A (B, n) ndarray, where L[b, i] denotes average injection rate of router i
+            K, keys: The number of cells and a (K, ) ndarray of their keys, in ascending order
+            cell_b, cell_r, cell_oc: (K, ) ndarrays, the task graph, router and output channel of each cell
+            cell_offsets: A (B + 1, ) ndarray, cells of the b-th task graph are cell_offsets[b]: cell_offsets[b + 1]
+            cell: A (B, n, p) ndarray, where cell[b, i, j] denotes the cell of output channel (b, i, j), K if absent
+            hop_cell: A (h, ) ndarray, where hop_cell[k] denotes the cell passed by hop k of pkt_path
+            L_p2p: A (K + 1, p) ndarray, where L_p2p[c, j] denotes trasmission rate from input channel j to
+                (the output channel of) cell c in its router
+            RH: A (K + 1, ) ndarray, where RH[c] denotes the longest residual hops of packets passing cell c
+        Traffic built by fromChunks keeps features of cells only, where per-request fields (Graph, Src, Dst,
+        Vol, P_s2d, pkt_path and hop_cell) are None.
+    '''
+
+    def __init__(self, graphs, arch_arg, compact=False):
+        self.arch_arg = arch_arg
+        self.rter = RS.XYRouting(arch_arg)
+        graphs = [TaskGraph(G) for G in graphs]
+        B, n, p = len(graphs), arch_arg["n"], arch_arg["p"]
+        self.B = B
+        self.Graph = np.repeat(np.arange(B), [len(G) for G in graphs])
+        self.offsets = np.concatenate(([0], np.cumsum([len(G) for G in graphs]))).astype(np.int64)
+        G = TaskGraph.concat(graphs) if B != 1 else graphs[0]
+        self.Src, self.Dst, self.Vol = G.src.astype(np.int64), G.dst.astype(np.int64), G.vol.astype(float)
+        self.m = len(self.Vol)
+
+        # TODO: a single request for a (source, destination) pair only
+        assert len(np.unique((self.Graph * n + self.Src) * n + self.Dst)) == len(self.Graph)
+
+        self.P_s2d = self.Vol / np.bincount(self.Graph, self.Vol, minlength=B)[self.Graph]
+
+        # Set up cells, L_p2p, L, RH, pkt_path
+        pkt_path = self.rter.route(self.Src, self.Dst)
+        Rate = self.Vol * self.P_s2d
+        self.pkt_path = pkt_path
+        self.__setCells(np.unique(self.__hopKeys(pkt_path, self.Graph)) if compact else np.arange(B * n * p))
+        self.L_p2p = np.zeros((self.K + 1, p))
+        np.add.at(self.L_p2p, (self.hop_cell, pkt_path.ic), Rate[pkt_path.flow()])
+        self.L = np.zeros((B, n))
+        np.add.at(self.L, (self.Graph, self.Src), Rate)
+        self.__setRH()
+
+    @classmethod
+    def fromChunks(cls, chunks, arch_arg, compact=False):
+        '''Build traffic of a single task graph given in chunks, without holding all requests in memory
+        Every chunk is routed and accumulated into per-channel arrays, then dropped: L_p2p, L and RH are sums
+        and minimums over hops, and rates vol**2 / sum(Vol) are summed as vol**2, then divided by sum(Vol)
+        at the end. Memory is bounded by n * p * p and the size of a chunk.
+            chunks: An iterable of TaskGraphs (or lists of requests), see Util/GraphIO.iterChunks
+        '''
+        self = cls.__new__(cls)
+        self.arch_arg = arch_arg
+        self.rter = RS.XYRouting(arch_arg)
+        n, p = arch_arg["n"], arch_arg["p"]
+        self.B, self.m, total = 1, 0, 0.0
+        L_p2p, L = np.zeros(n * p * p), np.zeros((1, n))
+        RH = np.full(n * p + 1, PINF, dtype=int)
+        for chunk in chunks:
+            chunk = TaskGraph(chunk)
+            pkt_path = self.rter.route(chunk.src.astype(np.int64), chunk.dst.astype(np.int64))
+            Vol2 = chunk.vol**2
+            Key = pkt_path.router.astype(np.int64) * p + pkt_path.oc
+            L_p2p += np.bincount(Key * p + pkt_path.ic, Vol2[pkt_path.flow()], minlength=n * p * p)
+            L[0] += np.bincount(chunk.src, Vol2, minlength=n)
+            np.minimum.at(RH, Key, pkt_path.residualHops())
+            self.m, total = self.m + len(chunk), total + np.sum(chunk.vol)
+
+        self.Graph, self.Src, self.Dst, self.Vol, self.P_s2d, self.pkt_path = None, None, None, None, None, None
+        self.offsets = np.asarray([0, self.m], dtype=np.int64)
+        self.__setCells(np.nonzero(RH[:-1] != PINF)[0] if compact else np.arange(n * p))
+        self.L_p2p = np.zeros((self.K + 1, p))
+        self.L_p2p[:-1] = L_p2p.reshape(n * p, p)[self.keys] / total
+        self.L = L / total
+        self.RH = RH[np.append(self.keys, n * p)]       # the last one is PINF, for the sentinel cell
+        return self
+
+    def patch(self, Removed, Src, Dst, Vol):
+        '''Remove and add requests of a single task graph, where only routes of changed requests are visited
+            Removed: Indices of requests to be removed
+            Src, Dst, Vol: Requests to be added, which are appended after the remaining ones
+            Return:
+                Dirty: A (K, ) bool ndarray of cells whose traffic has changed
+                Moved: A (K_old, ) ndarray, where Moved[c] denotes the new index of the c-th cell before patching,
+                    as cells passed by added requests may be inserted in compact mode
+        '''
+        if self.B != 1 or self.pkt_path is None:
+            raise Exception("Only traffic of a single task graph, held in memory, could be patched")
+        p = self.arch_arg["p"]
+        Removed = np.unique(np.asarray(Removed, dtype=np.int64))
+        Kept = np.setdiff1d(np.arange(len(self.Vol)), Removed)
+        Src, Dst = np.asarray(Src, dtype=np.int64), np.asarray(Dst, dtype=np.int64)
+        Vol_add = np.asarray(Vol, dtype=float)
+        Vol = np.concatenate((self.Vol[Kept], Vol_add))
+        total_old, total = np.sum(self.Vol), np.sum(Vol)
+
+        # Cells are kept even if no request passes them anymore, and those of added requests are inserted
+        rm_path, add_path = self.pkt_path.take(Removed), self.rter.route(Src, Dst)
+        Moved = np.arange(self.K)
+        Keys = np.union1d(self.keys, self.__hopKeys(add_path, np.zeros(len(Vol_add), dtype=np.int64)))
+        if len(Keys) != self.K:
+            Moved = np.searchsorted(Keys, self.keys)
+            L_p2p = np.zeros((len(Keys) + 1, p))
+            L_p2p[Moved] = self.L_p2p[:-1]
+            self.L_p2p = L_p2p
+            self.__setCells(Keys)
+        Rm_cell = self.cell[0, rm_path.router, rm_path.oc]
+        Add_cell = self.cell[0, add_path.router, add_path.oc]
+
+        # Rate of a request is vol**2 / sum(Vol), rescale everything if the sum is changed
+        L_p2p, L = self.L_p2p, self.L[0]
+        if total != total_old:
+            L_p2p *= total_old / total
+            L *= total_old / total
+        np.add.at(L_p2p, (Rm_cell, rm_path.ic), -(self.Vol[Removed]**2 / total)[rm_path.flow()])
+        np.add.at(L_p2p, (Add_cell, add_path.ic), (Vol_add**2 / total)[add_path.flow()])
+        np.add.at(L, self.Src[Removed], -self.Vol[Removed]**2 / total)
+        np.add.at(L, Src, Vol_add**2 / total)
+
+        self.Src, self.Dst = np.concatenate((self.Src[Kept], Src)), np.concatenate((self.Dst[Kept], Dst))
+        self.Vol, self.P_s2d, self.m = Vol, Vol / total, len(Vol)
+        self.Graph, self.offsets = np.zeros(len(Vol), dtype=np.int64), np.asarray([0, len(Vol)], dtype=np.int64)
+        self.pkt_path = PathSet.concat([self.pkt_path.take(Kept), add_path])
+        self.hop_cell = self.cell[0, self.pkt_path.router, self.pkt_path.oc]
+        self.__setRH()
+
+        Dirty = np.zeros(self.K, dtype=bool)
+        Dirty[Rm_cell], Dirty[Add_cell] = True, True
+        if total != total_old:
+            Dirty[:] = True
+        return Dirty, Moved
+
+    def __hopKeys(self, pkt_path, Graph):
+        '''Return: A (h, ) ndarray of keys of output channels passed by hops of pkt_path'''
+        n, p = self.arch_arg["n"], self.arch_arg["p"]
+        return (Graph[pkt_path.flow()].astype(np.int64) * n + pkt_path.router) * p + pkt_path.oc
+
+    def __setCells(self, Keys):
+        B, n, p = self.B, self.arch_arg["n"], self.arch_arg["p"]
+        self.keys, self.K = Keys, len(Keys)
+        Rest, self.cell_oc = np.divmod(Keys, p)
+        self.cell_b, self.cell_r = np.divmod(Rest, n)
+        self.cell_offsets = np.searchsorted(self.cell_b, np.arange(B + 1))
+        self.cell = np.full(B * n * p, self.K, dtype=np.int32 if self.K < 2**31 - 1 else np.int64)
+        self.cell[Keys] = np.arange(self.K)
+        self.cell = self.cell.reshape(B, n, p)
+        self.hop_cell = None
+        if self.pkt_path is not None:
+            self.hop_cell = self.cell[self.Graph[self.pkt_path.flow()], self.pkt_path.router, self.pkt_path.oc]
+
+    def __setRH(self):
+        pkt_path = self.pkt_path
+        self.RH = np.tile(PINF, self.K + 1).astype(int)
+        np.minimum.at(self.RH, self.hop_cell, pkt_path.residualHops())
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(root + "/Util")
+
+from Util.XYRouting import XYRouting, PORT2IDX
+from Util.TaskGraph import TaskGraph
+from Util import GraphIO
+
+
+class CommGraph:
+    '''A communication graph to be mapped onto the PE array, shared by mappers (SA, GA)
+    Nodes of the graph are placed on n PEs (slots) by labels, an int array giving the slot of every node.
+    Requests between the same pair of nodes are merged (the last volume is kept), and accesses to memory
+    (node -1) are assigned to d memory banks in a round-robin style, represented by the last row of PE array,
+    so requests are routed on a mesh of d x (d + 1) routers.
+        arch_arg: Architecture arguments
+        nodes: A list of nodes
+        req_node: A (2, m) ndarray of source and destination nodes of requests (between PEs, from memory, then
+            to memory), -1 for a memory bank
+        req_bank: A (2, m) ndarray of routers of memory banks assigned to requests, -1 for a node
+        req_vol: A (m, ) ndarray of volumes of requests
+    '''
+
+    def __init__(self, comm_graph_path, arch_config_path):
+        self.arch_arg = self.__readArchConfig(arch_config_path)
+        whole_comm_graph = GraphIO.loadGraph(root + "/" + comm_graph_path)[0]      # text or binary, see Util/GraphIO
+        d, n = self.arch_arg["d"], self.arch_arg["n"]
+
+        comm_graph_between_pe = {(src, dst): vol for src, dst, vol in whole_comm_graph if src != -1 and dst != -1}
+        comm_graph_with_mem = {(src, dst): vol for src, dst, vol in whole_comm_graph if src == -1 or dst == -1}
+        srcs_dsts = [node for req in comm_graph_between_pe for node in req]
+        assert False not in [i in set(srcs_dsts) for i in range(n)]    # 保证n个是全用到的
+        self.nodes = list(set(srcs_dsts))
+
+        between_pe = list(comm_graph_between_pe)
+        with_src_mem = [req for req in comm_graph_with_mem if req[0] == -1]
+        with_dst_mem = [req for req in comm_graph_with_mem if req[1] == -1]
+        src_bank = [i % d + n for i in range(len(with_src_mem))]
+        dst_bank = [i % d + n for i in range(len(with_dst_mem))]
+        self.req_node = np.array([
+            [src for src, _ in between_pe] + [-1] * len(with_src_mem) + [src for src, _ in with_dst_mem],
+            [dst for _, dst in between_pe] + [dst for _, dst in with_src_mem] + [-1] * len(with_dst_mem)
+        ], dtype=np.int64).reshape(2, -1)
+        self.req_bank = np.array([
+            [-1] * len(between_pe) + src_bank + [-1] * len(with_dst_mem),
+            [-1] * (len(between_pe) + len(with_src_mem)) + dst_bank
+        ], dtype=np.int64).reshape(2, -1)
+        self.req_vol = np.array([comm_graph_between_pe[req] for req in between_pe]
+                                + [comm_graph_with_mem[req] for req in with_src_mem + with_dst_mem], dtype=np.float64)
+        # banks are placed in an extra row, so routes are looked up in a route table of d x (d + 1) routers
+        self.rter = XYRouting(dict(self.arch_arg, h=d + 1))
+
+    def __len__(self):
+        return self.req_node.shape[1]
+
+    def channels(self):
+        '''Return: # of directed channels of the mesh, see channelKeys'''
+        return self.arch_arg["d"] * (self.arch_arg["d"] + 1) * 4
+
+    def routers(self, labels, Req=slice(None)):
+        '''Return: Source and destination routers of requests Req (all by default) under labels
+            labels: A (n, ) array, or a (k, n) array of k mappings, which gives (k, len(Req)) routers
+        '''
+        labels = np.asarray(labels)
+        Node, Bank = self.req_node[:, Req], self.req_bank[:, Req]
+        return (np.where(Node[0] >= 0, labels[..., Node[0]], Bank[0]),
+                np.where(Node[1] >= 0, labels[..., Node[1]], Bank[1]))
+
+    def channelKeys(self, Src, Dst):
+        '''Route requests given by (flattened) routers
+            Return: Directed channels (router * 4 + output channel - 2) passed by requests, and the request of each
+        '''
+        Src, Dst = np.ravel(Src), np.ravel(Dst)
+        pkt_path = self.rter.route(Src, Dst)
+        hop = pkt_path.oc >= PORT2IDX["north"]      # the last hop leaves through the output port
+        Owner = np.repeat(np.arange(len(Src)), np.diff(pkt_path.offsets))
+        return pkt_path.router[hop].astype(np.int64) * 4 + pkt_path.oc[hop] - PORT2IDX["north"], Owner[hop]
+
+    def label2TaskGraph(self, labels):
+        '''Translate transmission requests between PEs according to labels'''
+        Src, Dst = self.routers(labels)
+        return TaskGraph.fromArrays(Src, Dst, self.req_vol)
+
+    def writeTaskGraph(self, task_graph_path, task_graph):
+        full_task_graph_path = root + "/" + task_graph_path
+        GraphIO.saveGraph(full_task_graph_path, task_graph)
+
+    def __readArchConfig(self, arch_config_path):
+        full_arch_config_path = root + "/" + arch_config_path
+        if not os.path.exists(full_arch_config_path):
+            raise Exception("Invalid configuration path!")
+        with open(full_arch_config_path, "r") as f:
+            return json.load(f)
@@ -0,0 +1,160 @@
+import os
+import sys
+import numpy as np
+import argparse
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+sys.path.append(root + "/Util")
+
+from Mapping.CommGraph import CommGraph
+
+
+class GA:
+    '''Genetic Algorithm for Task Mapping Problem
+    The same problem as SA: nodes of the communication graph are placed on n PEs (slots), minimizing the
+    maximum # of requests on a channel (consumption). The population is a (population, n) int32 array, each
+    row of which is a permutation giving the slot of every node, and evolves by tournament selection,
+    permutation-preserving crossover (PMX or OX), swap mutation and elitism. Consumption of the whole
+    population is counted at once, by looking routes of all requests of all individuals up in the all-pairs
+    route table and a single bincount over (individual, channel).
+    '''
+    population = 64
+    generations = 500
+    crossover = "pmx"       # or "ox"
+    crossover_rate = 0.9
+    mutation_rate = 0.3     # probability of swapping two slots of a child
+    tournament = 3
+    elite = 2
+    max_pairs = 1 << 20     # requests routed at once when counting consumption
+
+    def __init__(self, seed=None, population=None, generations=None, crossover=None):
+        '''seed: Seed of the RNG, a random one if None
+            population, generations, crossover: Class attributes if None
+        '''
+        print("log: Employing GA for searching mapping stratey")
+        self.rng = np.random.default_rng(seed)
+        self.population = self.population if population is None else population
+        self.generations = self.generations if generations is None else generations
+        self.crossover = self.crossover if crossover is None else crossover
+        if self.crossover not in ["pmx", "ox"]:
+            raise Exception("Unknown crossover {}!".format(self.crossover))
+
+    def execute(self, task_graph_path, comm_graph_path, arch_config_path):
+        self.comm_graph = CommGraph(comm_graph_path, arch_config_path)
+        self.arch_arg = self.comm_graph.arch_arg
+        n, size = self.arch_arg["n"], self.population
+
+        Pop = self.rng.permuted(np.tile(np.arange(n, dtype=np.int32), (size, 1)), axis=1)
+        Fit = self.__fitness(Pop)
+        print("\n -------------- Task Mapping ---------------\n")
+        for generation in range(1, self.generations + 1):
+            order = np.argsort(Fit, kind="stable")
+            Parent = Pop[self.__select(Fit, size - self.elite)]
+            Child = self.__crossover(Parent)
+            self.__mutate(Child)
+            Pop = np.concatenate([Pop[order[:self.elite]], Child])
+            Fit = np.concatenate([Fit[order[:self.elite]], self.__fitness(Child)])
+            if generation % 100 == 0:
+                print("generation: {}, best consumption: {}, mean consumption: {}"
+                      .format(generation, int(np.min(Fit)), np.mean(np.floor(Fit))))
+
+        labels = Pop[np.argmin(Fit)]
+        print("labels: ", dict(enumerate(labels.tolist())))
+        print("score: ", int(np.min(Fit)))
+        task_graph = self.comm_graph.label2TaskGraph(labels)
+        self.comm_graph.writeTaskGraph(task_graph_path, task_graph)
+        return task_graph
+
+    def __fitness(self, Pop):
+        '''Count requests on directed channels (router * 4 + output channel - 2) for every individual at once
+            Return: A (population, ) ndarray of consumption plus the fraction of channels carrying that many
+                requests, so that ties of consumption are broken by how often it occurs
+        '''
+        m, channels = len(self.comm_graph), self.comm_graph.channels()
+        ret = np.empty(len(Pop))
+        batch = max(1, self.max_pairs // max(m, 1))
+        for begin in range(0, len(Pop), batch):
+            Part = Pop[begin: begin + batch]
+            Key, Owner = self.comm_graph.channelKeys(*self.comm_graph.routers(Part))
+            Load = np.bincount(Owner // m * channels + Key, minlength=len(Part) * channels).reshape(len(Part), channels)
+            Max = Load.max(axis=1)
+            ret[begin: begin + batch] = Max + np.count_nonzero(Load == Max[:, np.newaxis], axis=1) / (channels + 1)
+        return ret
+
+    def __select(self, Fit, k):
+        '''Return: Indices of k individuals, each the fittest of tournament individuals drawn at random'''
+        Candidate = self.rng.integers(len(Fit), size=(k, self.tournament))
+        return Candidate[np.arange(k), np.argmin(Fit[Candidate], axis=1)]
+
+    def __crossover(self, Parent):
+        '''Return: Children of pairs of consecutive parents, crossed over with probability crossover_rate'''
+        Child = Parent.copy()
+        n = Parent.shape[1]
+        for i in range(0, len(Parent) - 1, 2):
+            if self.rng.random() >= self.crossover_rate:
+                continue
+            a, b = np.sort(self.rng.choice(n + 1, 2, replace=False))
+            cross = self.__pmx if self.crossover == "pmx" else self.__ox
+            Child[i], Child[i + 1] = cross(Parent[i], Parent[i + 1], a, b), cross(Parent[i + 1], Parent[i], a, b)
+        return Child
+
+    def __pmx(self, P1, P2, a, b):
+        '''Partially mapped crossover: the child takes P1[a: b], and the rest from P2, where a value already taken
+        is replaced by following the mapping P1[i] -> P2[i] of the segment until it is not in the segment
+        '''
+        Child = P2.copy()
+        Child[a:b] = P1[a:b]
+        Map = np.arange(len(P1))
+        Map[P1[a:b]] = P2[a:b]
+        In_seg = np.zeros(len(P1), dtype=bool)
+        In_seg[P1[a:b]] = True
+        Out = np.r_[0:a, b:len(P1)]
+        Value = Child[Out]
+        for _ in range(b - a):
+            taken = In_seg[Value]
+            if not taken.any():
+                break
+            Value[taken] = Map[Value[taken]]
+        Child[Out] = Value
+        return Child
+
+    def __ox(self, P1, P2, a, b):
+        '''Order crossover: the child takes P1[a: b], then fills the rest from b on with values of P2 in their
+        order from b, skipping those taken
+        '''
+        n = len(P1)
+        Child = np.empty_like(P1)
+        Child[a:b] = P1[a:b]
+        Taken = np.zeros(n, dtype=bool)
+        Taken[P1[a:b]] = True
+        Rest = np.roll(P2, -b)
+        Child[np.roll(np.arange(n), -b)[:n - (b - a)]] = Rest[~Taken[Rest]]
+        return Child
+
+    def __mutate(self, Pop):
+        '''Swap two slots of individuals with probability mutation_rate, in place'''
+        Mutant = np.flatnonzero(self.rng.random(len(Pop)) < self.mutation_rate)
+        I, J = self.rng.integers(Pop.shape[1], size=(2, len(Mutant)))
+        Pop[Mutant, I], Pop[Mutant, J] = Pop[Mutant, J], Pop[Mutant, I]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", help="Path for communication graph, with the root directory as NoCPerformanceModel")
+    parser.add_argument("-o", help="Path for task graph, with the root directory as NoCPerformanceModel")
+    parser.add_argument("-c", help="Path for architecture configruation.")
+    parser.add_argument("--seed", type=int, help="Seed of the search, a random one by default")
+    parser.add_argument("-p", "--population", type=int, help="Size of population, {} by default".format(GA.population))
+    parser.add_argument("-g", "--generations", type=int, help="# of generations, {} by default".format(GA.generations))
+    parser.add_argument("-x", "--crossover", choices=["pmx", "ox"], help="Crossover, {} by default".format(GA.crossover))
+    args = parser.parse_args()
+
+    print("\nlog: Searching for mapping strategy",
+          "Path for communication graph: " + args.i,
+          "Path for task graph:" + args.o,
+          "Path for configuration file:" + args.c,
+          sep="\n")
+
+    ga = GA(args.seed, args.population, args.generations, args.crossover)
+    ga.execute(args.o, args.i, args.c)
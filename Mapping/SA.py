@@ -1,11 +1,11 @@
 import os
 import sys
 import numpy as np
-from copy import deepcopy
-from random import sample, random, randint
+from random import Random
 import argparse
 import math
-import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 
 root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root)
@@ -13,7 +13,36 @@ sys.path.append(root + "/Driver")
 sys.path.append(root + "/Util")
 
 from Driver.SDriver import Driver
-from Util.XYRouting import XYRouting
+from Mapping.CommGraph import CommGraph
+
+
+def workerInit(comm_graph_path, arch_config_path, shm_name, chains):
+    '''Set up the SA owned by a worker process of SA.executeParallel, and attach states of chains shared by
+    SA.executeParallel
+    '''
+    global worker_sa, worker_shm, worker_states
+    worker_sa = SA()
+    worker_sa.prepare(comm_graph_path, arch_config_path)
+    worker_shm = SharedMemory(name=shm_name)
+    worker_states = np.ndarray((2, chains, worker_sa.arch_arg["n"]), dtype=np.int32, buffer=worker_shm.buf)
+
+
+def workerAnneal(chain, seed, temperature, alpha, T_min, episodes, best_consp):
+    '''Anneal a chain from its present state in the shared memory, then write its present and best states back
+        Return: Statistics of the segment, see SA.runChain
+    '''
+    ret = worker_sa.runChain(worker_states[0, chain], seed, temperature, alpha, T_min, episodes, best_consp)
+    worker_states[0, chain] = worker_sa.labels
+    best_labels = ret.pop("best_labels")
+    if best_labels is not None:
+        worker_states[1, chain] = best_labels
+    return ret
+
+
+def chainSeed(seed, chain, segment):
+    '''Return: The seed of an RNG owned by a segment of a chain, derived from the seed of the whole search'''
+    return int(np.random.SeedSequence([seed, chain, segment]).generate_state(1)[0])
+
 
 class SA:
     '''Simulated Annealing Algorithm for Task Mapping Problem
@@ -26,13 +55,27 @@ class SA:
     alpha = 0.98
     global_epc_limit = 1e6
     local_epc_limit = 100
+    model_budget = 200      # evaluations of the performance model when mapping for latency
+    screen_ratio = 1.1      # candidates consuming more than screen_ratio x the present one skip the model
 
-    def __init__(self):
+    def __init__(self, seed=None, T=None, T_min=None, alpha=None):
+        '''seed: Seed of the RNG of moves, a random one if None
+            T, T_min, alpha: Initial and final temperature and the cooling rate, class attributes if None
+        '''
         print("log: Employing SA for searching mapping stratey")
         super().__init__()
+        self.rng = Random(seed)
+        self.T = self.T if T is None else T
+        self.T_min = self.T_min if T_min is None else T_min
+        self.alpha = self.alpha if alpha is None else alpha
         self.estimate_driver = Driver()
 
-    def execute(self, task_graph_path, comm_graph_path, arch_config_path):
+    def execute(self, task_graph_path, comm_graph_path, arch_config_path, usr_config_path=None, budget=None):
+        '''Search for a mapping by annealing on the maximum # of requests on a channel (consumption)
+        If usr_config_path is given, the mapping is refined for the latency estimated by Driver.execute_mem with
+        the user configuration afterwards, see __refine.
+            budget: # of evaluations of the performance model, model_budget by default
+        '''
         self.task_graph_path = task_graph_path
         self.comm_graph_path = comm_graph_path
         self.arc_config_path = arch_config_path
@@ -40,158 +83,373 @@ class SA:
         self.__readData(comm_graph_path, arch_config_path)
         
 
-        temperature = self.T
-        overall_counter = 0
         self.__initLabels()
         min_consp = self.__consumption(self.labels)
         print("\n -------------- Task Mapping ---------------\n")
-        while temperature > self.T_min and overall_counter < self.global_epc_limit:
+        min_consp = self.__anneal(min_consp, self.T, self.alpha, self.T_min, self.global_epc_limit, log=True)["consp"]
+        if usr_config_path is not None:
+            min_consp = self.__refine(min_consp, usr_config_path, self.model_budget if budget is None else budget)
+
+        # FIXME: 实验设置
+        # self.labels = np.arange(len(self.labels), dtype=np.int32)
+
+        print("labels: ", dict(enumerate(self.labels.tolist())))
+        print("score: ", min_consp)
+        task_graph = self.comm_graph.label2TaskGraph(self.labels)
+        self.comm_graph.writeTaskGraph(task_graph_path, task_graph)
+        # self.comm_graph.writeTaskGraph(task_graph_path, comm_graph_path)
+        return task_graph
+
+    def executeParallel(self, task_graph_path, comm_graph_path, arch_config_path, chains, workers=None,
+                        tempering=False, exchange_interval=20):
+        '''Search by chains annealing in a pool of worker processes, and write the best mapping found
+        States of chains (the present and the best labels of every chain) are kept in shared memory, chains
+        are annealed for exchange_interval episodes at a time, then exchange their states:
+            multi-start (default): Every chain cools down from T by its own schedule, and the chain in the worst
+                present state restarts from the best state found by all chains
+            tempering: Chains stay at temperatures spaced geometrically between T_min and T, and neighboring
+                temperatures are swapped between chains by the Metropolis criterion (replica exchange)
+        Every segment of a chain has its own RNG seeded from the seed of SA, so a search is reproducible.
+            chains: # of chains
+            workers: # of worker processes, # of chains or cores (the less one) by default
+            Return:
+                task_graph: The TaskGraph of the best mapping, which is written to task_graph_path as well
+                stats: A list of dicts of chains, with items
+                    best, present: The best and the present consumption
+                    moves, accepted: # of moves tried and accepted
+                    swaps: # of temperatures swapped (tempering), or restarts from the best state (multi-start)
+                    temperature: The final temperature
+        '''
+        self.__readData(comm_graph_path, arch_config_path)
+        n = self.arch_arg["n"]
+        seed = self.rng.getrandbits(64)
+        workers = workers or min(chains, os.cpu_count())
+        # a single chain of the same schedule would anneal as many episodes
+        episodes = int(min(self.global_epc_limit, math.ceil(math.log(self.T_min / self.T) / math.log(self.alpha))))
+        if tempering:
+            temperatures = np.geomspace(self.T, self.T_min, chains) if chains > 1 else np.array([self.T_min])
+            alpha, T_min = 1.0, 0.0
+        else:
+            temperatures = np.full(chains, float(self.T))
+            alpha, T_min = self.alpha, self.T_min
+        print("log: Searching by {} {} chains in {} workers, seed {}"
+              .format(chains, "tempering" if tempering else "multi-start", workers, seed))
+
+        shm = SharedMemory(create=True, size=2 * chains * n * np.dtype(np.int32).itemsize)
+        try:
+            States = np.ndarray((2, chains, n), dtype=np.int32, buffer=shm.buf)
+            stats = []
+            for chain in range(chains):
+                self.rng.seed(chainSeed(seed, chain, 0))
+                self.labels.fill(-1)
+                self.asgn_labels.fill(-1)
+                self.__initLabels()
+                States[0, chain], States[1, chain] = self.labels, self.labels
+                consp = self.__consumption(self.labels)
+                stats.append({"best": consp, "present": consp, "moves": 0, "accepted": 0, "swaps": 0,
+                              "temperature": float(temperatures[chain])})
+            self.rng.seed(seed)
+
+            with ProcessPoolExecutor(workers, initializer=workerInit,
+                                     initargs=(comm_graph_path, arch_config_path, shm.name, chains)) as pool:
+                for segment in range(math.ceil(episodes / exchange_interval)):
+                    running = [c for c in range(chains) if stats[c]["temperature"] > T_min]
+                    if len(running) == 0:
+                        break
+                    futures = {c: pool.submit(workerAnneal, c, chainSeed(seed, c, segment + 1), stats[c]["temperature"],
+                                              alpha, T_min, exchange_interval, stats[c]["best"]) for c in running}
+                    for c in running:
+                        ret = futures[c].result()
+                        stats[c].update(best=ret["best_consp"], present=ret["consp"], temperature=ret["temperature"])
+                        stats[c]["moves"] += ret["moves"]
+                        stats[c]["accepted"] += ret["accepted"]
+                    if tempering:
+                        self.__exchangeTemperatures(stats, segment % 2)
+                    else:
+                        self.__restartWorst(stats, States)
+                    if (segment + 1) * exchange_interval // 100 > segment * exchange_interval // 100:
+                        print("episode: {}, best consumption: {}".format((segment + 1) * exchange_interval,
+                                                                         min(st["best"] for st in stats)))
+            best = min(range(chains), key=lambda c: stats[c]["best"])
+            self.__setLabels(States[1, best])
+        finally:
+            shm.close()
+            shm.unlink()
+
+        for chain, st in enumerate(stats):
+            print("chain {}: best {}, present {}, accepted {} / {} moves, {} swaps, temperature {}".format(
+                chain, st["best"], st["present"], st["accepted"], st["moves"], st["swaps"], st["temperature"]))
+        print("labels: ", dict(enumerate(self.labels.tolist())))
+        print("score: ", stats[best]["best"])
+        task_graph = self.comm_graph.label2TaskGraph(self.labels)
+        self.comm_graph.writeTaskGraph(task_graph_path, task_graph)
+        return task_graph, stats
+
+    def prepare(self, comm_graph_path, arch_config_path):
+        '''Read the communication graph and architecture, for runChain'''
+        self.__readData(comm_graph_path, arch_config_path)
+
+    def runChain(self, labels, seed, temperature, alpha, T_min, episodes, best_consp=math.inf):
+        '''Anneal for a segment of a chain starting from labels, with the RNG seeded by seed
+            best_consp: The best consumption of the chain so far
+            Return: A dict with items
+                consp, temperature: The present consumption and temperature, with the state left in self.labels
+                best_consp, best_labels: The best consumption and its labels, None if best_consp is not improved
+                moves, accepted: # of moves tried and accepted
+        '''
+        self.rng.seed(seed)
+        self.__setLabels(labels)
+        consp = self.__consumption(self.labels)
+        return self.__anneal(consp, temperature, alpha, T_min, episodes, best_consp)
+
+    def __anneal(self, consp, temperature, alpha, T_min, episodes, best_consp=math.inf, log=False):
+        '''Anneal from the present state until the temperature drops to T_min or after episodes, see runChain'''
+        overall_counter, moves, accepted, best_labels = 0, 0, 0, None
+        while temperature > T_min and overall_counter < episodes:
             for i in range(self.local_epc_limit):
                 try:
-                    new_lables, new_asgn_labels, _, _ = self.__disturbance(deepcopy(self.labels), deepcopy(self.asgn_labels))
-                    new_consp = self.__consumption(new_lables)
-                    delta_E = (new_consp - min_consp) / (min_consp + 1e-10) * 100
+                    new_consp, undo = self.__swap(*self.__disturbance())
+                    moves += 1
+                    delta_E = (new_consp - consp) / (consp + 1e-10) * 100
                     if self.__judge(delta_E, temperature):
-                        min_consp = new_consp
-                        self.labels, self.asgn_labels = new_lables, new_asgn_labels
+                        consp = new_consp
+                        accepted += 1
+                        if consp < best_consp:
+                            best_consp, best_labels = consp, self.labels.copy()
+                    else:
+                        self.__undo(undo)
                     if delta_E < 0:     # have found a better solution
                         break
                 except Exception:
                     pass
-            temperature = temperature * self.alpha
+            temperature = temperature * alpha
             overall_counter += 1
-            if overall_counter % 100 == 0:
-                print("episode: {}, present consumption: {}, temperature: {}".format(overall_counter, min_consp, temperature))
+            if log and overall_counter % 100 == 0:
+                print("episode: {}, present consumption: {}, temperature: {}".format(overall_counter, consp, temperature))
+        return {"consp": consp, "temperature": temperature, "best_consp": best_consp, "best_labels": best_labels,
+                "moves": moves, "accepted": accepted}
 
-        # FIXME: 实验设置
-        # self.labels = {i: i for i in range(len(self.labels))}
+    def __refine(self, consp, usr_config_path, budget):
+        '''Anneal at T_min for the latency estimated by the performance model, starting from the present state
+        Consumption serves as a surrogate of latency: a candidate consuming more than screen_ratio times the
+        present state is rejected without the model, others are estimated by Driver.execute_mem unless the same
+        labels have been estimated before. It stops once budget evaluations are made (or budget x
+        local_epc_limit moves are tried), and the best state estimated is kept, or the annealed state if the model fails
+        on every state.
+            Return: Consumption of the best state, with statistics kept in self.model_stats
+        '''
+        cache, stats = {}, {"evaluations": 0, "cache_hits": 0, "screened": 0, "moves": 0, "agreements": 0, "failures": 0}
 
-        print("labels: ", self.labels)
-        print("score: ", min_consp)
-        task_graph = self.__label2TaskGraph(self.labels)
-        self.__writeTaskGraph(task_graph_path, task_graph)
-        # self.__writeTaskGraph(task_graph_path, comm_graph_path)
-        return task_graph
+        def latencyOf():
+            key = self.labels.tobytes()
+            if key in cache:
+                stats["cache_hits"] += 1
+            else:
+                stats["evaluations"] += 1
+                task_graph = self.comm_graph.label2TaskGraph(self.labels)
+                cache[key] = self.estimate_driver.execute_mem(task_graph, usr_config_path, self.arc_config_path, False)
+            return cache[key]
 
-    def __readData(self, comm_graph_path, arch_config_path):
-        arch_arg = self.__readArchConfig(arch_config_path)
-        whole_comm_graph = self.__readCommGraph(comm_graph_path)
+        print("\n -------------- Refining for Latency ---------------\n")
+        try:
+            latency = latencyOf()
+        except Exception as e:
+            # candidates are still refined from here, and the annealed state is kept if none is estimated
+            print("Warn: Failed to estimate the annealed state: {}".format(e))
+            latency = math.inf
+        best_latency, best_consp, best_labels = latency, consp, self.labels.copy()
+        while stats["evaluations"] < budget and stats["moves"] < budget * self.local_epc_limit:
+            new_consp, undo = self.__swap(*self.__disturbance())
+            stats["moves"] += 1
+            if new_consp > consp * self.screen_ratio:
+                stats["screened"] += 1
+                self.__undo(undo)
+                continue
+            try:
+                new_latency = latencyOf()
+            except Exception as e:
+                print("Warn: Failed to estimate a candidate: {}".format(e))
+                stats["failures"] += 1
+                self.__undo(undo)
+                continue
+            stats["agreements"] += (new_consp < consp) == (new_latency < latency)
+            delta_E = -math.inf if latency == math.inf else (new_latency - latency) / (latency + 1e-10) * 100
+            if self.__judge(delta_E, self.T_min):
+                consp, latency = new_consp, new_latency
+                if latency < best_latency:
+                    best_latency, best_consp, best_labels = latency, consp, self.labels.copy()
+            else:
+                self.__undo(undo)
+        self.__setLabels(best_labels)
+        self.__consumption(self.labels)
 
-        comm_graph_between_pe = [req for req in whole_comm_graph if req[0] != -1 and req[1] != -1]
-        srcs, dsts, vols = zip(*comm_graph_between_pe)
-        self.comm_graph_between_pe = {sd: vol for sd, vol in zip(zip(srcs, dsts), vols)}
+        estimated = stats["moves"] - stats["screened"] - stats["failures"]
+        result_cache = getattr(getattr(self.estimate_driver, "estimator", None), "result_cache", None)
+        stats.update(latency=best_latency, agreement=stats["agreements"] / max(estimated, 1),
+                     result_cache=None if result_cache is None else result_cache.stats())
+        print("log: {} / {} model evaluations, {} cache hits, {} of {} candidates screened out by consumption"
+              .format(stats["evaluations"], budget, stats["cache_hits"], stats["screened"], stats["moves"]))
+        print("log: consumption agrees with the model on {:.1%} of {} candidates, result cache: {}"
+              .format(stats["agreement"], estimated, stats["result_cache"]))
+        print("latency: ", best_latency)
+        self.model_stats = stats
+        return best_consp
 
-        comm_graph_with_mem = [req for req in whole_comm_graph if req[0] == -1 or req[1] == -1]
-        msrcs, mdsts, mvols = zip(*comm_graph_with_mem)
-        self.comm_graph_with_mem = {sd: vol for sd, vol in zip(zip(msrcs, mdsts), mvols)}
+    def __exchangeTemperatures(self, stats, parity):
+        '''Swap temperatures of chains at neighboring temperatures, pairs starting from the parity-th coldest'''
+        order = sorted(range(len(stats)), key=lambda c: stats[c]["temperature"])
+        for k in range(parity, len(order) - 1, 2):
+            cold, hot = stats[order[k]], stats[order[k + 1]]
+            # the same relative scale of energy as moves, see __anneal
+            delta = (1 / cold["temperature"] - 1 / hot["temperature"]) * (hot["present"] - cold["present"]) \
+                / (min(cold["present"], hot["present"]) + 1e-10) * 100
+            if delta >= 0 or math.exp(delta) > self.rng.random():
+                cold["temperature"], hot["temperature"] = hot["temperature"], cold["temperature"]
+                cold["swaps"] += 1
+                hot["swaps"] += 1
 
-        n = arch_arg["n"]
+    def __restartWorst(self, stats, States):
+        '''Restart the chain in the worst present state from the best state found by all chains'''
+        best = min(range(len(stats)), key=lambda c: stats[c]["best"])
+        worst = max(range(len(stats)), key=lambda c: stats[c]["present"])
+        if stats[best]["best"] < stats[worst]["present"]:
+            States[0, worst] = States[1, best]
+            stats[worst]["present"] = stats[best]["best"]
+            stats[worst]["swaps"] += 1
 
-        assert False not in [i in set(srcs + dsts) for i in range(n)]    # 保证n个是全用到的
+    def __setLabels(self, labels):
+        '''Place nodes by labels (node -> slot)'''
+        self.labels = np.array(labels, dtype=np.int32)
+        self.asgn_labels = np.full(self.arch_arg["n"], -1, dtype=np.int32)
+        Node = np.flatnonzero(self.labels >= 0)
+        self.asgn_labels[self.labels[Node]] = Node
 
-        self.nodes = list(set(srcs + dsts))
-        self.labels = {node: -1 for node in range(n)}
-        self.asgn_labels = {i: -1 for i in range(n)}
+    def __readData(self, comm_graph_path, arch_config_path):
+        self.comm_graph = CommGraph(comm_graph_path, arch_config_path)
+        self.arch_arg = self.comm_graph.arch_arg
+        self.nodes = self.comm_graph.nodes
+        n = self.arch_arg["n"]
+        # labels[node] gives the slot (PE) of a node, asgn_labels[slot] gives the node placed there, -1 for none
+        self.labels = np.full(n, -1, dtype=np.int32)
+        self.asgn_labels = np.full(n, -1, dtype=np.int32)
+        self.__initIncident()
+
+    def __initIncident(self):
+        '''Requests incident to every node: indices of requests from or to node v are
+        incident[inc_offsets[v]: inc_offsets[v + 1]]
+        '''
+        n = self.arch_arg["n"]
+        Node = self.comm_graph.req_node.ravel()
+        Req = np.tile(np.arange(len(self.comm_graph)), 2)
+        order = np.argsort(Node, kind="stable")
+        order = order[Node[order] >= 0]
+        self.incident = Req[order]
+        self.inc_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(Node[order], minlength=n)[:n], out=self.inc_offsets[1:])
 
     def __initLabels(self):
         n = self.arch_arg["n"]
         for node in self.nodes:
-            label = randint(0, n - 1)
+            label = self.rng.randint(0, n - 1)
             while self.asgn_labels[label] != -1:
-                label = randint(0, n - 1)
+                label = self.rng.randint(0, n - 1)
             self.labels[node] = label
             self.asgn_labels[label] = node
 
-    def __disturbance(self, labels, asgn_labels):
-        l1, l2 = sample(asgn_labels.keys(), 2)
-        while asgn_labels[l1] == -1 and asgn_labels[l2] == -1:      # 避免交换两个空的label
-            l2, l2 = sample(asgn_labels.keys(), 2)
-        try:
-            labels[asgn_labels[l1]], labels[asgn_labels[l2]] = l2, l1
-        except KeyError:
-            pass
-        asgn_labels[l1], asgn_labels[l2] = asgn_labels[l2], asgn_labels[l1]     # swap assigned labels
-        return labels, asgn_labels, l1, l2
+    def __disturbance(self):
+        '''Return: Two slots to be swapped, at least one of which is assigned'''
+        n = self.arch_arg["n"]
+        l1, l2 = self.rng.sample(range(n), 2)
+        while self.asgn_labels[l1] == -1 and self.asgn_labels[l2] == -1:      # 避免交换两个空的label
+            l1, l2 = self.rng.sample(range(n), 2)
+        return l1, l2
+
+    def __swap(self, l1, l2):
+        '''Swap nodes placed in slots l1 and l2 in place, and update channel loads by requests incident to them
+            Return:
+                consp: The maximum count of requests on a channel after the swap
+                undo: A record for __undo to roll the swap back
+        '''
+        labels, asgn_labels = self.labels, self.asgn_labels
+        node1, node2 = int(asgn_labels[l1]), int(asgn_labels[l2])
+        o = self.inc_offsets
+        Req = np.unique(np.concatenate([self.incident[o[v]: o[v + 1]] for v in (node1, node2) if v != -1]
+                                       + [np.zeros(0, dtype=np.int64)]))
+        Src, Dst = self.comm_graph.routers(labels, Req)
+        if node1 != -1:
+            labels[node1] = l2
+        if node2 != -1:
+            labels[node2] = l1
+        asgn_labels[l1], asgn_labels[l2] = node2, node1
+        New_src, New_dst = self.comm_graph.routers(labels, Req)
+
+        Key, Owner = self.comm_graph.channelKeys(np.concatenate([Src, New_src]), np.concatenate([Dst, New_dst]))
+        Key, Inv = np.unique(Key, return_inverse=True)
+        Delta = np.bincount(Inv, weights=np.where(Owner < len(Req), -1, 1), minlength=len(Key)).astype(np.int64)
+        Key, Delta = Key[Delta != 0], Delta[Delta != 0]
+        return self.__addLoad(Key, Delta), (l1, l2, node1, node2, Key, Delta)
+
+    def __undo(self, undo):
+        '''Roll back a swap by its undo record, without routing again'''
+        l1, l2, node1, node2, Key, Delta = undo
+        if node1 != -1:
+            self.labels[node1] = l1
+        if node2 != -1:
+            self.labels[node2] = l2
+        self.asgn_labels[l1], self.asgn_labels[l2] = node1, node2
+        self.__addLoad(Key, -Delta)
 
     def __consumption(self, labels):
-        d = self.arch_arg["d"]
-        task_graph = self.__label2TaskGraph(labels)
-        router_dropin = np.zeros(((d + 1) * (d + 1), 4), dtype=np.int32)
-        rter = XYRouting(self.arch_arg)
-        path = rter.path(task_graph)
-        for req in path:
-            router_path, _, oport_path = zip(*req[:-1])
-            oport_path = [i - 2 for i in oport_path]
-            router_dropin[router_path, oport_path] += 1
-        consp = np.max(router_dropin)
-        return consp
+        '''Count requests passing every directed channel under labels, and return the maximum count
+        The counts are kept as the state of later __swap:
+            channel_load: channel_load[router * 4 + output channel - 2] denotes # of requests on the channel
+            load_count: load_count[c] denotes # of channels with c requests, so the maximum is found without
+                scanning all channels once a move changes a few of them
+        '''
+        m = len(self.comm_graph)
+        Key, _ = self.comm_graph.channelKeys(*self.comm_graph.routers(labels))
+        self.channel_load = np.bincount(Key, minlength=self.comm_graph.channels())
+        self.load_count = np.bincount(self.channel_load, minlength=m + 1)
+        self.max_load = int(np.max(self.channel_load, initial=0))
+        return self.max_load
+
+    def __addLoad(self, Key, Delta):
+        '''Add Delta requests to channels Key (unique), and return the maximum count of requests on a channel'''
+        Load = self.channel_load[Key]
+        np.subtract.at(self.load_count, Load, 1)
+        np.add.at(self.load_count, Load + Delta, 1)
+        self.channel_load[Key] = Load + Delta
+        self.max_load = max(self.max_load, int(np.max(Load + Delta, initial=0)))
+        while self.max_load > 0 and self.load_count[self.max_load] == 0:
+            self.max_load -= 1
+        return self.max_load
 
     def __judge(self, delta_E, tempreature):
         if delta_E < 0:
             return True
-        elif math.exp(-delta_E / tempreature) > random():
+        elif math.exp(-delta_E / tempreature) > self.rng.random():
             return True
         else:
             return False
 
-    def __label2TaskGraph(self, labels):
-        '''Translate transmission requests between PEs according to labels
-        Assign access to memory with multi banks in a round-roubin style, represented by the last row of PE array
-        '''
-        L = labels
-        comm_graph_with_mem, comm_graph_between_pe = self.comm_graph_with_mem, self.comm_graph_between_pe
-        task_graph_between_pe = [
-            (L[src], L[dst], comm_graph_between_pe[(src, dst)])
-            for src, dst in comm_graph_between_pe
-        ]
-        d = self.arch_arg["d"]      # TODO: bank 与边长相同
-        bias = self.arch_arg["n"]
-
-        comm_graph_with_src_mem = [req for req in comm_graph_with_mem if req[0] == -1]
-        comm_graph_with_dst_mem = [req for req in comm_graph_with_mem if req[1] == -1]
-
-        mapped_bank_src = [i % d + bias for i in range(len(comm_graph_with_src_mem))]
-        mapped_bank_dst = [i % d + bias for i in range(len(comm_graph_with_dst_mem))]
-
-        task_graph_with_src_mem = [
-            (mb, L[dst], comm_graph_with_mem[(src, dst)])
-            for mb, (src, dst) in zip(mapped_bank_src, comm_graph_with_src_mem)
-        ]
-
-        task_graph_with_dst_mem = [
-            (L[src], mb, comm_graph_with_mem[(src, dst)])
-            for mb, (src, dst) in zip(mapped_bank_dst, comm_graph_with_dst_mem)
-        ]
-        task_graph = task_graph_between_pe + task_graph_with_src_mem + task_graph_with_dst_mem
-        return task_graph
-
-    def __readCommGraph(self, comm_graph_path):
-        full_comm_graph_path = root + "/" + comm_graph_path
-        with open(full_comm_graph_path, "r") as f:
-            comm_graph = [eval(line) for line in f]
-        self.comm_graph_with_mem = comm_graph
-        return comm_graph
-
-    def __readArchConfig(self, arch_config_path):
-        full_arch_config_path = root + "/" + arch_config_path
-        if not os.path.exists(full_arch_config_path):
-            raise Exception("Invalid configuration path!")
-        with open(full_arch_config_path, "r") as f:
-            self.arch_arg = json.load(f)
-        return self.arch_arg
-
-    def __writeTaskGraph(self, task_graph_path, task_graph):
-        full_task_graph_path = root + "/" + task_graph_path
-        with open(full_task_graph_path, "w") as f:
-            for req in task_graph:
-                f.write(",".join(str(x) for x in req) + "\n")
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", help="Path for communication graph, with the root directory as NoCPerformanceModel")
     parser.add_argument("-o", help="Path for task graph, with the root directory as NoCPerformanceModel")
     parser.add_argument("-c", help="Path for architecture configruation.")
+    parser.add_argument("-n", "--chains", type=int, default=1, help="# of annealing chains run in parallel")
+    parser.add_argument("-w", "--workers", type=int, help="# of worker processes, min(chains, cores) by default")
+    parser.add_argument("--tempering", action="store_true", help="Exchange temperatures between chains "
+                        "(replica exchange) instead of restarting chains from the best state")
+    parser.add_argument("--seed", type=int, help="Seed of the search, a random one by default")
+    parser.add_argument("--T", type=float, help="Initial temperature, {} by default".format(SA.T))
+    parser.add_argument("--T_min", type=float, help="Final temperature, {} by default".format(SA.T_min))
+    parser.add_argument("--alpha", type=float, help="Cooling rate, {} by default".format(SA.alpha))
+    parser.add_argument("-uc", help="Refine the mapping for latency estimated with the user configuration, "
+                        "e.g. Configuration/baseline.json")
+    parser.add_argument("--budget", type=int, help="# of evaluations of the performance model, {} by default"
+                        .format(SA.model_budget))
     args = parser.parse_args()
 
     print("\nlog: Searching for mapping strategy",
@@ -200,5 +458,10 @@ if __name__ == "__main__":
           "Path for configuration file:" + args.c,
           sep="\n")
 
-    sa = SA()
-    sa.execute(args.o, args.i, args.c)
+    sa = SA(args.seed, args.T, args.T_min, args.alpha)
+    if args.chains > 1:
+        if args.uc is not None:
+            raise Exception("Refining for latency is supported by a single chain only!")
+        sa.executeParallel(args.o, args.i, args.c, args.chains, args.workers, args.tempering)
+    else:
+        sa.execute(args.o, args.i, args.c, args.uc, args.budget)
@@ -1,9 +1,14 @@
 import os
-# import sys
+import sys
 import argparse
 import numpy as np
 from random import sample, shuffle
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Util import GraphIO
+from Util.TaskGraph import TaskGraph
+
 
 def generate(of_path, arch_arg):
     n = arch_arg["n"]
@@ -17,11 +22,9 @@ def generate(of_path, arch_arg):
 
     min_vol, max_vol = 0, 500
     vols = np.random.normal((min_vol + max_vol) / 2, 80, len(links))
-    comm_graphs = [tuple(list(sd) + [vol]) for sd, vol in zip(links, vols)]
-
-    with open(of_path, "w") as f:
-        for req in comm_graphs:
-            f.write(",".join(str(x) for x in req) + "\n")
+    srcs, dsts = np.asarray(links, dtype=np.int64).reshape(-1, 2).T
+    comm_graphs = TaskGraph.fromArrays(srcs, dsts, vols)
+    GraphIO.saveGraph(of_path, comm_graphs)      # text, or binary if of_path ends with .nocg
 
 
 if __name__ == "__main__":
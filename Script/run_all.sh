@@ -9,4 +9,8 @@ cd ..
 # python Mapping/graphGen.py -d $pe_diameter -o $comm_graph_path
 # python Analyzer/analyzer.py -o $comm_graph_path -i $directive_path -c $arch_config_path
 python Mapping/SA.py -o $task_graph_path -i $comm_graph_path -c $arch_config_path
+# python Mapping/SA.py -o $task_graph_path -i $comm_graph_path -c $arch_config_path -n 32 --tempering
+# python Mapping/GA.py -o $task_graph_path -i $comm_graph_path -c $arch_config_path
 # python Driver/SDriver.py -i $task_graph_path -uc $usr_config_path -ac $arch_config_path
+# python Driver/Server.py -w 4 &
+# python Driver/Client.py -i $task_graph_path -uc $usr_config_path -ac $arch_config_path
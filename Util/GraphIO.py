@@ -0,0 +1,305 @@
+'''Reading and writing task graphs (and communication graphs) in bulk
+
+Text graphs keep the existing CSV layout, one request "src,dst,vol" per line, optionally followed by extra
+columns, e.g. (vol, # of iterations) pairs of graphs with finer granularity (*_fgn.txt), which makes rows
+ragged. Binary graphs (*.nocg) are laid out as
+    header: 16 bytes, "<4sHHQ" of the magic b"NOCG", version, flags and m, the number of requests
+    records: m records of 16 bytes, "<i4" src, "<i4" dst and "<f8" vol, i.e. TaskGraph.dtype
+    extra block, if flags & HAS_EXTRA: m + 1 "<i8" offsets, then offsets[-1] "<f8" values, where extra columns of
+        request i are values[offsets[i]: offsets[i + 1]]
+so records and the extra block are 8-byte aligned and could be memory-mapped without parsing.
+Extra columns are given and returned as a pair of arrays (offsets, values), None if there are none.
+'''
+
+import io
+import os
+import struct
+from itertools import islice
+import numpy as np
+from Util.TaskGraph import TaskGraph
+
+
+MAGIC = b"NOCG"
+VERSION = 1
+HAS_EXTRA = 1
+HEADER = struct.Struct("<4sHHQ")
+RECORD = np.dtype([("src", "<i4"), ("dst", "<i4"), ("vol", "<f8")])
+CHUNK = 1 << 20     # # of requests formatted at a time when writing text
+
+
+def isBinary(path):
+    '''Return: Whether the file at path is a binary graph, by its magic number'''
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def loadGraph(path, mmap=True):
+    '''Load a task graph from a binary or text file
+        mmap: Memory-map records of a binary file instead of reading them
+        Return:
+            task_graph: A TaskGraph of (src, dst, vol)
+            extra: (offsets, values) of extra columns, None if there are none
+    '''
+    return loadBinary(path, mmap) if isBinary(path) else loadText(path)
+
+
+def saveGraph(path, task_graph, extra=None, binary=None):
+    '''Save a task graph, in the binary format if binary is True, or by default if path ends with .nocg'''
+    if binary is None:
+        binary = path.endswith(".nocg")
+    if binary:
+        saveBinary(path, task_graph, extra)
+    else:
+        saveText(path, task_graph, extra)
+
+
+def fromRows(rows):
+    '''Split rows of numbers (src, dst, vol, extra columns...), which may have different lengths
+        Return: task_graph, extra, the same as loadGraph
+    '''
+    rows = [tuple(r) for r in rows]
+    Count = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+    if np.any(Count < 3):
+        raise Exception("A request should give src, dst and vol at least")
+    Values = np.fromiter((x for r in rows for x in r), dtype=np.float64, count=int(np.sum(Count)))
+    return _split(Values, Count)
+
+
+def loadText(path):
+    '''Load a task graph from a CSV file, see loadGraph'''
+    if os.path.getsize(path) == 0:
+        return TaskGraph(), None
+    try:
+        Rows = np.loadtxt(path, delimiter=",", ndmin=2, dtype=np.float64)
+    except ValueError:
+        with open(path, "rb") as f:
+            return _parseRagged(f.read(), path)
+    return _fromRows(Rows, path)
+
+
+def iterChunks(path, chunk_size=1 << 20):
+    '''Read a task graph chunk by chunk, so that memory is bounded by chunk_size rather than the graph
+        Return: A generator of TaskGraphs of at most chunk_size requests each, extra columns are dropped
+    '''
+    if isBinary(path):
+        task_graph = loadBinary(path)[0]
+        for begin in range(0, len(task_graph), chunk_size):
+            yield task_graph[begin: begin + chunk_size]        # views of the memory-mapped file
+        return
+    with open(path, "r") as f:
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                return
+            try:
+                Rows = np.loadtxt(lines, delimiter=",", ndmin=2, dtype=np.float64)
+            except ValueError:
+                yield _parseRagged("".join(lines).encode(), path)[0]
+                continue
+            yield _fromRows(Rows, path)[0]
+
+
+def spool(chunks, path):
+    '''Pass chunks through while appending them to a binary graph file at path, see loadGraph
+    The file is complete once all chunks are consumed, e.g. to read a one-shot iterator twice.
+        Return: A generator of the given chunks as TaskGraphs
+    '''
+    m = 0
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for chunk in chunks:
+            chunk = TaskGraph(chunk)
+            chunk.data.astype(RECORD, copy=False).tofile(f)
+            m += len(chunk)
+            yield chunk
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, m))
+
+
+def saveText(path, task_graph, extra=None):
+    '''Save a task graph as a CSV file, vol and extra columns are written in the shortest exact form'''
+    with open(path, "w") as f:
+        _writeText(f, task_graph, extra)
+
+
+def loadBinary(path, mmap=True):
+    '''Load a task graph from a binary file, see loadGraph
+    With mmap, the returned TaskGraph and extra columns view the file, which should not be changed meanwhile.
+    '''
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    return _parseBinary(path, header, os.path.getsize(path), mmap)
+
+
+def saveBinary(path, task_graph, extra=None):
+    '''Save a task graph as a binary file, see loadGraph'''
+    with open(path, "wb") as f:
+        _writeBinary(f, task_graph, extra)
+
+
+def loadBytes(data):
+    '''Load a task graph from the content of a binary or text graph file, e.g. received from a socket
+    Records of binary content are viewed without copying.
+        Return: task_graph, extra, the same as loadGraph
+    '''
+    if bytes(data[:len(MAGIC)]) == MAGIC:
+        return _parseBinary(data, bytes(data[:HEADER.size]), len(data), False)
+    if len(data) == 0:
+        return TaskGraph(), None
+    try:
+        Rows = np.loadtxt(io.BytesIO(data), delimiter=",", ndmin=2, dtype=np.float64)
+    except ValueError:
+        return _parseRagged(bytes(data), "<bytes>")
+    return _fromRows(Rows, "<bytes>")
+
+
+def dumpBytes(task_graph, extra=None, binary=True):
+    '''Return: The content of a binary (or text) graph file holding the task graph, see loadBytes'''
+    if binary:
+        f = io.BytesIO()
+        _writeBinary(f, task_graph, extra)
+        return f.getvalue()
+    f = io.StringIO()
+    _writeText(f, task_graph, extra)
+    return f.getvalue().encode()
+
+
+def _writeText(f, task_graph, extra):
+    task_graph = TaskGraph(task_graph)
+    m = len(task_graph)
+    Offsets, Values = _checkExtra(extra, m)
+    fmts = {}
+    for begin in range(0, m, CHUNK):
+        end = min(begin + CHUNK, m)
+        G = task_graph[begin: end]
+        if Offsets is None:
+            f.write(("%d,%d,%r\n" * (end - begin)) % tuple(np.column_stack(
+                (G.src.astype(object), G.dst.astype(object), _cells(G.vol))).ravel().tolist()))
+            continue
+        Count = np.diff(Offsets[begin: end + 1])
+        for c in np.unique(Count).tolist():
+            fmts.setdefault(c, "%d,%d,%r" + ",%r" * c + "\n")
+        # Interleave requests with their extra columns
+        Row_begin = np.arange(end - begin) * 3 + (Offsets[begin: end] - Offsets[begin])
+        Cell = np.empty(3 * (end - begin) + int(Offsets[end] - Offsets[begin]), dtype=object)
+        Cell[Row_begin], Cell[Row_begin + 1], Cell[Row_begin + 2] = G.src.tolist(), G.dst.tolist(), _cells(G.vol)
+        Is_extra = np.ones(len(Cell), dtype=bool)
+        Is_extra[Row_begin], Is_extra[Row_begin + 1], Is_extra[Row_begin + 2] = False, False, False
+        Cell[Is_extra] = _cells(Values[Offsets[begin]: Offsets[end]])
+        f.write("".join([fmts[c] for c in Count.tolist()]) % tuple(Cell.tolist()))
+
+
+def _cells(Values):
+    '''Return: An object ndarray of Values formatted by %r as the CSV layout, integral values as ints without ".0"'''
+    Values = np.asarray(Values, dtype=np.float64)
+    Cell = Values.astype(object)
+    integral = np.isfinite(Values) & (np.abs(Values) < 2**53)
+    integral[integral] = Values[integral] == np.round(Values[integral])
+    Cell[integral] = Values[integral].astype(np.int64).tolist()
+    return Cell
+
+
+def _writeBinary(f, task_graph, extra):
+    task_graph = TaskGraph(task_graph)
+    Offsets, Values = _checkExtra(extra, len(task_graph))
+    f.write(HEADER.pack(MAGIC, VERSION, 0 if Offsets is None else HAS_EXTRA, len(task_graph)))
+    f.write(np.ascontiguousarray(task_graph.data.astype(RECORD, copy=False)).data)
+    if Offsets is not None:
+        f.write(Offsets.astype("<i8", copy=False).data)
+        f.write(np.ascontiguousarray(Values, dtype="<f8").data)
+
+
+def _parseBinary(source, header, size, mmap):
+    '''Return: task_graph, extra of a binary graph held by a file (the path as source) or a buffer'''
+    name = source if isinstance(source, str) else "<bytes>"
+    if len(header) < HEADER.size:
+        raise Exception("Invalid graph file {}: truncated header".format(name))
+    magic, version, flags, m = HEADER.unpack(header)
+    if magic != MAGIC or version > VERSION:
+        raise Exception("Invalid graph file {}: magic {}, version {}".format(name, magic, version))
+    end = HEADER.size + m * RECORD.itemsize
+    if size < end + (8 * (m + 1) if flags & HAS_EXTRA else 0):
+        raise Exception("Invalid graph file {}: truncated records".format(name))
+
+    task_graph = TaskGraph(_read(source, RECORD, HEADER.size, m, mmap))
+    if not flags & HAS_EXTRA:
+        return task_graph, None
+    Offsets = _read(source, np.dtype("<i8"), end, m + 1, mmap)
+    k = int(Offsets[-1])
+    if size < end + 8 * (m + 1) + 8 * k:
+        raise Exception("Invalid graph file {}: truncated extra columns".format(name))
+    return task_graph, (Offsets, _read(source, np.dtype("<f8"), end + 8 * (m + 1), k, mmap))
+
+
+def _parseRagged(data, path):
+    '''Return: task_graph, extra of text of ragged rows, or of requests written as tuples, e.g. "(0, 1, 2.0)"'''
+    lines = [line for line in data.translate(None, b"() \t\r").split(b"\n") if line]
+    Count = np.fromiter((line.count(b",") + 1 for line in lines), dtype=np.int64, count=len(lines))
+    Values = np.array(b",".join(lines).split(b","), dtype=np.float64) if lines else np.zeros(0)
+    if np.any(Count < 3):
+        raise Exception("Invalid graph file {}: a request should give src, dst and vol at least".format(path))
+    return _split(Values, Count)
+
+
+def _fromRows(Rows, path):
+    '''Return: task_graph, extra of a 2D array of rows of the same length'''
+    if Rows.size == 0:
+        return TaskGraph(), None
+    if Rows.shape[1] < 3:
+        raise Exception("Invalid graph file {}: a request should give src, dst and vol at least".format(path))
+    task_graph = TaskGraph.fromArrays(Rows[:, 0], Rows[:, 1], Rows[:, 2])
+    if Rows.shape[1] == 3:
+        return task_graph, None
+    Offsets = np.arange(len(Rows) + 1, dtype=np.int64) * (Rows.shape[1] - 3)
+    return task_graph, (Offsets, np.ascontiguousarray(Rows[:, 3:]).ravel())
+
+
+def _split(Values, Count):
+    '''Return: task_graph, extra of concatenated rows Values, where the i-th row has Count[i] columns'''
+    Begin = np.cumsum(Count) - Count
+    task_graph = TaskGraph.fromArrays(Values[Begin], Values[Begin + 1], Values[Begin + 2])
+    if np.all(Count == 3):
+        return task_graph, None
+    Offsets = np.zeros(len(Count) + 1, dtype=np.int64)
+    np.cumsum(Count - 3, out=Offsets[1:])
+    Is_extra = np.ones(len(Values), dtype=bool)
+    Is_extra[Begin], Is_extra[Begin + 1], Is_extra[Begin + 2] = False, False, False
+    return task_graph, (Offsets, Values[Is_extra])
+
+
+def _checkExtra(extra, m):
+    if extra is None:
+        return None, None
+    Offsets, Values = np.asarray(extra[0], dtype=np.int64), np.asarray(extra[1], dtype=np.float64)
+    if len(Offsets) != m + 1 or Offsets[0] != 0 or Offsets[-1] != len(Values) or np.any(np.diff(Offsets) < 0):
+        raise Exception("Invalid extra columns: offsets should be ascending from 0 to # of values, one per request")
+    return Offsets, Values
+
+
+def _read(source, dtype, offset, count, mmap):
+    '''Return: A read-only array of count items of dtype starting at offset of a file (the path as source) or a buffer'''
+    if not isinstance(source, str):
+        X = np.frombuffer(source, dtype=dtype, count=count, offset=offset)
+        X.flags.writeable = False
+        return X
+    path = source
+    if mmap and count > 0:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count, ))
+    with open(path, "rb") as f:
+        f.seek(offset)
+        X = np.fromfile(f, dtype=dtype, count=count)
+    X.flags.writeable = False
+    return X
+
+
+if __name__ == "__main__":
+    # python -m Util.GraphIO: text graphs shipped with the repository should be reproduced byte by byte
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in ["Temp/commGraph.txt", "Temp/commGraph_fgn.txt", "Temp/taskGraph.txt"]:
+        with open(root + "/" + name, "rb") as f:
+            data = f.read()
+        if dumpBytes(*loadBytes(data), binary=False) != data:
+            raise Exception("Text round trip changes {}!".format(name))
+        if dumpBytes(*loadBytes(dumpBytes(*loadBytes(data))), binary=False) != data:
+            raise Exception("Binary round trip changes {}!".format(name))
+        print("log: {} round-trips".format(name))
@@ -0,0 +1,86 @@
+import numpy as np
+
+
+def expandRanges(Begin, End):
+    '''Concatenate ranges [Begin[i], End[i]) without a Python loop
+        Return:
+            Index: Indices of all ranges in order
+            Owner: Owner[k] denotes the range that Index[k] comes from
+    '''
+    Begin, End = np.asarray(Begin, dtype=np.int64), np.asarray(End, dtype=np.int64)
+    Length = End - Begin
+    Offsets = np.zeros(len(Begin) + 1, dtype=np.int64)
+    np.cumsum(Length, out=Offsets[1:])
+    Owner = np.repeat(np.arange(len(Begin)), Length)
+    return Begin[Owner] - Offsets[Owner] + np.arange(Offsets[-1]), Owner
+
+
+class PathSet:
+    '''Routed paths of a task graph stored in compressed sparse row (CSR) format
+        Hops of the i-th path are router[offsets[i]: offsets[i + 1]] (likewise for ic, oc and channel),
+        ordered from the source router to the destination router.
+            router: A (h, ) int32 ndarray, where router[k] denotes the router passed by hop k
+            ic: A (h, ) int32 ndarray, where ic[k] denotes the input channel of hop k in view of the router
+            oc: A (h, ) int32 ndarray, where oc[k] denotes the output channel of hop k in view of the router
+            channel: A (h, ) int32 ndarray, where channel[k] denotes the link (XYRouting.rc2c) taken by hop k,
+                -1 for the last hop, which leaves the network through the output port
+            offsets: A (m + 1, ) int64 ndarray, where m is the number of paths
+        Indexing or iterating a PathSet gives lists of (router, input channel, output channel), the same as
+        what XYRouting.path used to return, but they are only built on demand.
+    '''
+
+    def __init__(self, router, ic, oc, channel, offsets):
+        self.router = np.asarray(router, dtype=np.int32)
+        self.ic = np.asarray(ic, dtype=np.int32)
+        self.oc = np.asarray(oc, dtype=np.int32)
+        self.channel = np.asarray(channel, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Path index out of range: {}".format(i))
+        b, e = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.router[b: e].tolist(), self.ic[b: e].tolist(), self.oc[b: e].tolist()))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def hops(self):
+        '''Return: A (m, ) ndarray, the number of hops (routers passed) of each path'''
+        return np.diff(self.offsets)
+
+    def flow(self):
+        '''Return: A (h, ) ndarray, where flow[k] denotes the path that hop k belongs to'''
+        if "flow" not in self.cache:
+            self.cache["flow"] = np.repeat(np.arange(len(self)), self.hops())
+        return self.cache["flow"]
+
+    def residualHops(self):
+        '''Return: A (h, ) ndarray, where residualHops[k] denotes # of hops left after hop k in its path'''
+        return self.offsets[self.flow() + 1] - 1 - np.arange(len(self.router))
+
+    def take(self, Index):
+        '''Return: A PathSet holding paths selected by Index, in the same order'''
+        Index = np.asarray(Index, dtype=np.int64)
+        Hop_index, _ = expandRanges(self.offsets[Index], self.offsets[Index + 1])
+        Offsets = np.zeros(len(Index) + 1, dtype=np.int64)
+        np.cumsum(self.offsets[Index + 1] - self.offsets[Index], out=Offsets[1:])
+        return PathSet(self.router[Hop_index], self.ic[Hop_index], self.oc[Hop_index],
+                       self.channel[Hop_index], Offsets)
+
+    @staticmethod
+    def concat(path_sets):
+        '''Return: A PathSet holding paths of all given PathSets, in the same order'''
+        Offsets = [np.zeros(1, dtype=np.int64)]
+        for ps in path_sets:
+            Offsets.append(ps.offsets[1:] + Offsets[-1][-1])
+        return PathSet(np.concatenate([ps.router for ps in path_sets]), np.concatenate([ps.ic for ps in path_sets]),
+                       np.concatenate([ps.oc for ps in path_sets]), np.concatenate([ps.channel for ps in path_sets]),
+                       np.concatenate(Offsets))
@@ -0,0 +1,183 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from Util.TaskGraph import TaskGraph
+
+
+class ResultCache:
+    '''Content-addressed cache of estimated latency of task graphs
+    A task graph is canonicalized by sorting its requests by (src, dst), and keyed by the SHA-1 digest of
+    the sorted arrays and the JSON of parameters, so the same evaluation hits no matter how requests are
+    ordered or which instance asks. Results are kept in canonical order and permuted back on lookup.
+        capacity: Max # of results kept in memory, least recently used ones are evicted first
+        memory_bytes: Size limit of results kept in memory, evicted the same way, a result larger than it is
+            only kept on disk
+        cache_dir: Directory of the optional on-disk tier, one .npz file per result, None to disable it
+        max_bytes: Size limit of the on-disk tier, least recently used files are deleted beyond it
+    Counters hits, disk_hits and misses are exposed, see stats. A cache could be shared by threads.
+    '''
+
+    def __init__(self, capacity=256, cache_dir=None, max_bytes=1 << 30, memory_bytes=1 << 28):
+        self.capacity, self.memory_bytes = capacity, memory_bytes
+        self.entries = OrderedDict()
+        self.entry_bytes = 0
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        self.lock = threading.RLock()
+        self.attach(cache_dir, max_bytes)
+
+    def attach(self, cache_dir, max_bytes=1 << 30):
+        '''Set the on-disk tier, None to detach it'''
+        with self.lock:
+            self.cache_dir, self.max_bytes = cache_dir, max_bytes
+            self.disk_bytes = 0
+            if cache_dir is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                self.disk_bytes = sum(size for _, size, _ in self.__diskEntries())
+        return self
+
+    @staticmethod
+    def attachTo(estimator, prj_arg, root):
+        '''Attach the on-disk tier given by prj_arg to the result cache of an estimator (class or instance), if any
+            prj_arg: result_cache_dir is relative to root, None (absent) to keep the cache in memory only, and
+                result_cache_bytes is the size limit of it
+        '''
+        result_cache = getattr(estimator, "result_cache", None)
+        cache_dir = prj_arg.get("result_cache_dir")
+        if cache_dir is not None and result_cache is not None and result_cache.cache_dir != root + "/" + cache_dir:
+            result_cache.attach(root + "/" + cache_dir, prj_arg.get("result_cache_bytes", 1 << 30))
+
+    @staticmethod
+    def canonicalize(task_graph):
+        '''Return:
+            Order: Requests of task_graph sorted by (src, dst), i.e. task_graph[Order[i]] is the i-th one
+            Src, Dst, Vol: Sorted arrays of the requests
+        '''
+        task_graph = TaskGraph(task_graph)
+        Src, Dst, Vol = task_graph.src.astype(np.int64), task_graph.dst.astype(np.int64), task_graph.vol
+        Order = np.lexsort((Dst, Src))
+        return Order, Src[Order], Dst[Order], Vol[Order]
+
+    @staticmethod
+    def key(Src, Dst, Vol, params):
+        '''Return: The hex digest of canonical arrays of a task graph and a JSON-serializable dict params'''
+        h = hashlib.sha1()
+        for X, dtype in [(Src, "<i8"), (Dst, "<i8"), (Vol, "<f8")]:
+            h.update(np.ascontiguousarray(X, dtype=dtype).tobytes())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def lookup(self, task_graph, params):
+        '''Return: Cached latency of requests of task_graph in its order, None on a miss'''
+        Order, Src, Dst, Vol = self.canonicalize(task_graph)
+        Value = self.get(self.key(Src, Dst, Vol, params))
+        if Value is None:
+            return None
+        Time = np.empty_like(Value)
+        Time[Order] = Value
+        return Time
+
+    def store(self, task_graph, params, Time):
+        '''Cache latency of requests of task_graph, given in its order'''
+        Order, Src, Dst, Vol = self.canonicalize(task_graph)
+        self.put(self.key(Src, Dst, Vol, params), np.asarray(Time, dtype=float)[Order])
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            Value = self.__loadDisk(key)
+            if Value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.__putMemory(key, Value)
+            return Value
+
+    def put(self, key, Value):
+        Value = np.array(Value)
+        Value.flags.writeable = False
+        with self.lock:
+            self.__putMemory(key, Value)
+            self.__saveDisk(key, Value)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "entries": len(self.entries), "entry_bytes": self.entry_bytes, "disk_bytes": self.disk_bytes}
+
+    def clear(self):
+        '''Drop the in-memory tier and reset counters, the on-disk tier is kept'''
+        with self.lock:
+            self.entries.clear()
+            self.entry_bytes = 0
+            self.hits, self.disk_hits, self.misses = 0, 0, 0
+
+    def __putMemory(self, key, Value):
+        if key in self.entries:
+            self.entry_bytes -= self.entries.pop(key).nbytes
+        if Value.nbytes > self.memory_bytes:
+            return
+        self.entries[key] = Value
+        self.entry_bytes += Value.nbytes
+        while len(self.entries) > self.capacity or self.entry_bytes > self.memory_bytes:
+            self.entry_bytes -= self.entries.popitem(last=False)[1].nbytes
+
+    def __path(self, key):
+        return "{}/{}.npz".format(self.cache_dir, key)
+
+    def __diskEntries(self):
+        '''Return: A list of (path, size, last access time) of files of the on-disk tier'''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                try:
+                    st = os.stat(self.cache_dir + "/" + name)
+                except OSError:
+                    continue
+                entries.append((self.cache_dir + "/" + name, st.st_size, st.st_mtime))
+        return entries
+
+    def __loadDisk(self, key):
+        if self.cache_dir is None or not os.path.exists(self.__path(key)):
+            return None
+        try:
+            with np.load(self.__path(key)) as f:
+                Value = f["time"]
+            os.utime(self.__path(key))                  # mtime marks the last access
+        except (OSError, ValueError, KeyError) as e:
+            print("Warn: Failed to load a cached result: {}".format(e))
+            return None
+        Value.flags.writeable = False
+        return Value
+
+    def __saveDisk(self, key, Value):
+        if self.cache_dir is None or os.path.exists(self.__path(key)):
+            return
+        try:
+            tmp = self.__path(key) + ".{}.tmp".format(os.getpid())
+            with open(tmp, "wb") as f:
+                np.savez(f, time=Value)
+            self.disk_bytes += os.path.getsize(tmp)
+            os.replace(tmp, self.__path(key))           # atomic, other processes may be loading it
+        except OSError as e:
+            print("Warn: Failed to save a cached result: {}".format(e))
+            return
+        if self.disk_bytes > self.max_bytes:
+            self.__evictDisk()
+
+    def __evictDisk(self):
+        entries = sorted(self.__diskEntries(), key=lambda e: e[2])
+        self.disk_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.disk_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.disk_bytes -= size
+            except OSError:
+                pass
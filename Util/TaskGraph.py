@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class TaskGraph:
+    '''An immutable task graph stored in columns
+        Requests are kept in a read-only NumPy structured array with fields
+            src, dst: int32 source and destination routers (or PEs)
+            vol: float64 volume of the request, or its injection rate in G_R of a sub-task
+        A TaskGraph could be built from another TaskGraph (shared without copying), a structured array or
+        any sequence of (src, dst, vol), and is accepted wherever a list of (src, dst, vol) used to be:
+        indexing by an integer or iterating gives (src, dst, vol) tuples of Python scalars, while slicing
+        gives a TaskGraph viewing the same memory.
+    '''
+    dtype = np.dtype([("src", np.int32), ("dst", np.int32), ("vol", np.float64)])
+
+    def __init__(self, requests=()):
+        if isinstance(requests, TaskGraph):
+            data = requests.data
+        elif isinstance(requests, np.ndarray) and requests.dtype.names is not None:
+            # a writable array may be changed by its owner later, so keep a copy of it
+            data = np.array(requests, dtype=self.dtype, copy=requests.flags.writeable or requests.dtype != self.dtype)
+        else:
+            Arr = np.array(requests if isinstance(requests, list) else list(requests), dtype=np.float64)
+            Arr = Arr.reshape(-1, 3) if Arr.size == 0 else Arr[:, :3]
+            data = np.empty(len(Arr), dtype=self.dtype)
+            data["src"], data["dst"], data["vol"] = Arr[:, 0], Arr[:, 1], Arr[:, 2]
+        data = data.reshape(-1)
+        data.flags.writeable = False
+        self.data = data
+
+    @classmethod
+    def fromArrays(cls, src, dst, vol):
+        '''Return: A TaskGraph of requests given by columns'''
+        data = np.empty(len(src), dtype=cls.dtype)
+        data["src"], data["dst"], data["vol"] = src, dst, vol
+        data.flags.writeable = False
+        return cls(data)
+
+    @staticmethod
+    def concat(graphs):
+        '''Return: A TaskGraph holding requests of all given task graphs, in the same order'''
+        return TaskGraph.fromArrays(np.concatenate([TaskGraph(G).src for G in graphs]),
+                                    np.concatenate([TaskGraph(G).dst for G in graphs]),
+                                    np.concatenate([TaskGraph(G).vol for G in graphs]))
+
+    @staticmethod
+    def pairKeys(Src, Dst):
+        '''Return: An int64 ndarray of keys of (src, dst) pairs, (src << 32) | dst, equal iff both are equal'''
+        return (np.asarray(Src, dtype=np.int64) << 32) | np.asarray(Dst, dtype=np.int64)
+
+    @staticmethod
+    def requestKeys(requests):
+        '''Return: pairKeys of requests given by a TaskGraph or an iterable of (src, dst, ...)'''
+        if isinstance(requests, TaskGraph):
+            return TaskGraph.pairKeys(requests.src, requests.dst)
+        Pair = np.array([(r[0], r[1]) for r in requests], dtype=np.int64).reshape(-1, 2)
+        return TaskGraph.pairKeys(Pair[:, 0], Pair[:, 1])
+
+    @property
+    def src(self):
+        return self.data["src"]
+
+    @property
+    def dst(self):
+        return self.data["dst"]
+
+    @property
+    def vol(self):
+        return self.data["vol"]
+
+    def withVol(self, vol):
+        '''Return: A TaskGraph of the same (src, dst) pairs with volumes (or rates) replaced by vol'''
+        return TaskGraph.fromArrays(self.src, self.dst, vol)
+
+    def take(self, index):
+        '''Return: A TaskGraph of requests selected by index (positions, or a boolean mask of every request), in the
+        same order
+        '''
+        Index = np.asarray(index)
+        if Index.dtype == bool:
+            if Index.shape != self.data.shape:
+                raise IndexError("A boolean mask of {} requests is given for {} requests".format(Index.size, len(self)))
+            Index = np.flatnonzero(Index)
+        data = self.data[Index.astype(np.int64)]
+        data.flags.writeable = False
+        return TaskGraph(data)
+
+    def tolist(self):
+        '''Return: A list of (src, dst, vol) tuples'''
+        return list(zip(self.src.tolist(), self.dst.tolist(), self.vol.tolist()))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TaskGraph(self.data[i])
+        if isinstance(i, (int, np.integer)):
+            r = self.data[i]
+            return (int(r["src"]), int(r["dst"]), float(r["vol"]))
+        return self.take(i)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (TaskGraph, (self.data, ))
+
+    def __repr__(self):
+        return "TaskGraph({})".format(self.tolist() if len(self) <= 8 else "{} requests".format(len(self)))
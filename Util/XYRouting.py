@@ -1,31 +1,102 @@
+import os
+import threading
+import numpy as np
+from Util.PathSet import PathSet, expandRanges
+from Util.TaskGraph import TaskGraph
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 PORT2IDX = {"input": 0, "output": 1, "north": 2, "south": 3, "west": 4, "east": 5}
 DIR2PORT = {(0, -1): "north", (0, 1): "south", (-1, 0): "west", (1, 0): "east"}
 
 
 class XYRouting:
+    '''XY routing on a mesh with d columns
+    Routers out of the d x d square (e.g. memory banks placed in an extra row) are routed as well, give
+    arch_arg["h"] as the number of rows if they should be covered by neighborTable and channels.
+    '''
+    use_table = True
 
     def __init__(self, arch_arg):
         self.arch_arg = arch_arg
         self.cache = {}
 
+    def routeTable(self, h=None):
+        '''Return the shared all-pairs RouteTable of this mesh, None if the mesh is too large to tabulate
+            h: # of rows to be covered, arch_arg["h"] (or d) by default
+        '''
+        d = self.arch_arg["d"]
+        h = self.arch_arg.get("h", d) if h is None else h
+        if not self.use_table or (d * h)**2 > RouteTable.max_pairs:
+            return None
+        return RouteTable.get(d, h)
+
     def path(self, task_graph):
         '''Do XY-routing for given task graph
-            task_graph: A list of (src, dst, vol)
+            task_graph: A TaskGraph, or a list of (src, dst, vol)
             Return:
-                A list of routed paths for requests in the task graph, where the path is
-                given as a list of (router, input channel, output channel)
+                A PathSet holding routed paths for requests in the task graph, where the i-th path is
+                given as a list of (router, input channel, output channel) when indexed
         '''
+        task_graph = TaskGraph(task_graph)
+        return self.route(task_graph.src.astype(np.int64), task_graph.dst.astype(np.int64))
+
+    def route(self, Src, Dst):
+        '''Same as path, but with the task graph given as arrays of sources and destinations'''
         if "pkt_path" in self.cache:
-            return self.cache["pkt_path"]
-        ret = []
-        for rqst in task_graph:
-            Router_path = self.__passedRouters(rqst[0], rqst[1])
-            Iport_path, Oport_path = self.__passedIOChannels(Router_path)
-            Router_path = [cord[1] * self.arch_arg["d"] + cord[0] for cord in Router_path]
-            ret.append(list(zip(Router_path, Iport_path, Oport_path)))
-        self.cache["pkt_path"] = ret
+            src, dst, ret = self.cache["pkt_path"]
+            if np.array_equal(src, Src) and np.array_equal(dst, Dst):
+                return ret
+        # Routers out of the d x h square (e.g. memory banks of SA without arch_arg["h"]) need more rows
+        table = self.routeTable(self.__rows(Src, Dst))
+        ret = self.batchPath(Src, Dst) if table is None else table.gather(Src, Dst)
+        self.cache["pkt_path"] = (np.array(Src), np.array(Dst), ret)
         return ret
 
+    def batchPath(self, Src, Dst):
+        '''Do XY-routing for all (src, dst) pairs at once
+        A path consists of an X segment (|dx| hops), a Y segment (|dy| hops) and the destination router,
+        so ports of all hops are given by repeating per-segment values, and routers by a cumulative sum
+        of per-hop steps.
+            Src, Dst: (m, ) int ndarrays of source and destination routers
+            Return:
+                A PathSet holding the m routed paths
+        '''
+        d = self.arch_arg["d"]
+        Src, Dst = np.asarray(Src, dtype=np.int32), np.asarray(Dst, dtype=np.int32)
+        m = len(Src)
+        src_x, src_y = Src % d, Src // d        # The 2D coordinate is left-half system
+        dst_x, dst_y = Dst % d, Dst // d
+        east, south = src_x < dst_x, src_y < dst_y
+        hop_x, hop_y = np.abs(dst_x - src_x), np.abs(dst_y - src_y)
+        Offsets = np.zeros(m + 1, dtype=np.int64)
+        np.cumsum(hop_x + hop_y + 1, out=Offsets[1:])
+
+        # Output channels and steps of hops in the X segment, Y segment and the destination router
+        Seg_len = np.stack([hop_x, hop_y, np.ones(m, dtype=np.int32)], axis=1).ravel()
+        Seg_oc = np.empty((m, 3), dtype=np.int8)
+        Seg_oc[:, 0] = np.where(east, PORT2IDX["east"], PORT2IDX["west"])
+        Seg_oc[:, 1] = np.where(south, PORT2IDX["south"], PORT2IDX["north"])
+        Seg_oc[:, 2] = PORT2IDX["output"]
+        Oport_path = np.repeat(Seg_oc.ravel(), Seg_len)
+        Seg_step = np.stack([np.where(east, 1, -1), np.where(south, d, -d), np.zeros(m, dtype=np.int32)], axis=1)
+        Step = np.repeat(Seg_step.astype(np.int32).ravel(), Seg_len)
+        Step[Offsets[1:-1] - 1] = Src[1:] - Dst[:-1]      # jump from a destination to the next source
+        Router_path = np.empty(Offsets[-1], dtype=np.int32)
+        if m > 0:
+            Router_path[0] = Src[0]
+            np.cumsum(Step[:-1], out=Router_path[1:])
+            Router_path[1:] += Src[0]
+
+        # Input channels: the input port, then ports entered along the X segment and the Y segment
+        Seg_ic = np.empty((m, 3), dtype=np.int8)
+        Seg_ic[:, 0] = PORT2IDX["input"]
+        Seg_ic[:, 1] = np.where(east, PORT2IDX["west"], PORT2IDX["east"])
+        Seg_ic[:, 2] = np.where(south, PORT2IDX["north"], PORT2IDX["south"])
+        Iport_path = np.repeat(Seg_ic.ravel(), np.stack([np.ones(m, dtype=np.int32), hop_x, hop_y], axis=1).ravel())
+
+        return PathSet(Router_path, Iport_path, Oport_path, self.channels(Router_path, Oport_path), Offsets)
+
     def packedPath(self, task_graph):
         '''Return routed paths of all requests in task graph handled by assigned routing strategy
         Routing strategy is set as XY routing by default.
@@ -39,31 +110,6 @@ class XYRouting:
         ret = {(r[0], r[1]): p for r, p in zip(task_graph, P)}
         return ret
 
-    def __passedRouters(self, src_rt, dst_rt):
-        d = self.arch_arg["d"]
-        src_x, src_y = int(src_rt % d), int(src_rt // d)      # The 2D coordinate is left-half system
-        dst_x, dst_y = int(dst_rt % d), int(dst_rt // d)
-        # X routing
-        step_x = 1 if src_x < dst_x else -1
-        Router_path = [(x, src_y) for x in range(src_x, dst_x, step_x)]
-        # Y routing
-        step_y = 1 if src_y < dst_y else -1
-        Router_path += [(dst_x, y) for y in range(src_y, dst_y, step_y)]
-        Router_path += [(dst_x, dst_y)]    # the destination router
-        Router_path = list(map(lambda x: (int(x[0]), int(x[1])), Router_path))
-        return Router_path
-
-    def __passedIOChannels(self, path):
-        Iport_path = [PORT2IDX["input"]]
-        Oport_path = []
-        for prev, pres in zip(path[:-1], path[1:]):
-            op_ = (pres[0] - prev[0], pres[1] - prev[1])
-            ip_ = (prev[0] - pres[0], prev[1] - pres[1])
-            Iport_path.append(PORT2IDX[DIR2PORT[ip_]])
-            Oport_path.append(PORT2IDX[DIR2PORT[op_]])
-        Oport_path.append(PORT2IDX["output"])
-        return Iport_path, Oport_path
-
     def pointTo(self, src, oc):
         d = self.arch_arg["d"]
         if oc == PORT2IDX["west"]:
@@ -84,6 +130,46 @@ class XYRouting:
             raise Exception("Router exceeded the boundary: router = {}, oc = {}".format(src, oc))
         return ret, ic
 
+    def neighborTable(self):
+        '''Vectorized pointTo for every (router, output channel) of the mesh
+            Return:
+                Nbr_r: A (n, p) int ndarray, where Nbr_r[i, j] denotes the router that output channel j
+                    of router i points to, -1 for the local ports and the boundaries
+                Nbr_ic: A (n, p) int ndarray, where Nbr_ic[i, j] denotes the input channel of Nbr_r[i, j]
+                    that output channel j of router i is connected to, -1 if there isn't any
+        '''
+        if "nbr" in self.cache:
+            return self.cache["nbr"]
+        table = self.routeTable()
+        if table is not None:
+            self.cache["nbr"] = (table.nbr_r, table.nbr_ic)
+            return self.cache["nbr"]
+        d = self.arch_arg["d"]
+        h = self.arch_arg.get("h", d)
+        n, p = d * h, len(PORT2IDX)
+        x, y = np.arange(n) % d, np.arange(n) // d
+        Nbr_r = np.full((n, p), -1, dtype=np.int64)
+        Nbr_ic = np.full((n, p), -1, dtype=np.int64)
+        for oc, ic, step, valid in [
+            (PORT2IDX["west"], PORT2IDX["east"], -1, x > 0),
+            (PORT2IDX["east"], PORT2IDX["west"], 1, x < d - 1),
+            (PORT2IDX["north"], PORT2IDX["south"], -d, y > 0),
+            (PORT2IDX["south"], PORT2IDX["north"], d, y < h - 1)
+        ]:
+            Nbr_r[valid, oc] = np.arange(n)[valid] + step
+            Nbr_ic[valid, oc] = ic
+        self.cache["nbr"] = (Nbr_r, Nbr_ic)
+        return Nbr_r, Nbr_ic
+
+    def __rows(self, *Routers):
+        '''Return: # of rows covering the given routers and the d x h square'''
+        d = self.arch_arg["d"]
+        h = self.arch_arg.get("h", d)
+        for R in Routers:
+            if len(R) > 0:
+                h = max(h, int(np.max(R)) // d + 1)
+        return h
+
     def rc2c(self, r, oc):
         d = self.arch_arg["d"]
         base = (r // d) * (2 * d - 1)
@@ -97,7 +183,105 @@ class XYRouting:
             ret = base + r % d + d - 1
         return int(ret)
 
+    def channels(self, R, OC):
+        '''Vectorized rc2c
+            R, OC: Routers and their output channels
+            Return:
+                An int32 ndarray of channel indices, -1 is given to the input and output ports
+        '''
+        d, h = self.arch_arg["d"], self.__rows(R)
+        if "channel" in self.cache and len(self.cache["channel"]) < d * h:
+            del self.cache["channel"]
+        if "channel" not in self.cache and self.routeTable(h) is not None:
+            self.cache["channel"] = self.routeTable(h).channel_table
+        if "channel" not in self.cache:
+            R_ = np.arange(d * h)[:, np.newaxis]
+            bias = np.zeros(len(PORT2IDX), dtype=np.int64)
+            bias[PORT2IDX["west"]], bias[PORT2IDX["east"]] = -1, 0
+            bias[PORT2IDX["north"]], bias[PORT2IDX["south"]] = -d, d - 1
+            Table = (R_ // d) * (2 * d - 1) + R_ % d + bias
+            Table[:, :PORT2IDX["north"]] = -1
+            self.cache["channel"] = Table.astype(np.int32)
+        Table = self.cache["channel"]
+        return Table.ravel()[np.asarray(R, dtype=np.int64) * Table.shape[1] + OC]
+
+
+class RouteTable:
+    '''XY routes between all pairs of routers of a mesh with d columns and h rows
+    Routes depend on (d, h, src, dst) only, so the table is built once, saved as .npy files under cache_dir
+    and memory-mapped by every later process. Paths are stored in CSR format, where routes of the pair
+    (src, dst) are hops offsets[pid]: offsets[pid + 1] with pid = src * n + dst.
+        router, ic, oc, channel: Hop arrays, see PathSet
+        offsets: A (n**2 + 1, ) int64 ndarray
+        nbr_r, nbr_ic: (n, p) neighbor tables, see XYRouting.neighborTable
+        channel_table: A (n, p) table of channel indices, see XYRouting.channels
+    The table grows as n**2.5, XYRouting falls back to batchPath for meshes with more than max_pairs pairs.
+    '''
+    cache_dir = root + "/Temp/RouteTable"
+    max_pairs = 1 << 16
+    tables = {}
+    lock = threading.Lock()
+    fields = ["router", "ic", "oc", "channel", "offsets", "nbr_r", "nbr_ic", "channel_table"]
+
+    @classmethod
+    def get(cls, d, h=None):
+        '''Return the route table of a d x h mesh, which is loaded or built only once per process'''
+        h = d if h is None else h
+        with cls.lock:
+            if (d, h) not in cls.tables:
+                cls.tables[(d, h)] = cls(d, h)
+            return cls.tables[(d, h)]
+
+    def __init__(self, d, h=None):
+        self.d, self.h = d, d if h is None else h
+        self.n = self.d * self.h
+        if not self.__load():
+            self.__build()
+            self.__save()
+            self.__load()
+
+    def gather(self, Src, Dst):
+        '''Return: A PathSet holding routes of the given (src, dst) pairs'''
+        Pid = np.asarray(Src, dtype=np.int64) * self.n + np.asarray(Dst, dtype=np.int64)
+        Index, _ = expandRanges(self.offsets[Pid], self.offsets[Pid + 1])
+        Offsets = np.zeros(len(Pid) + 1, dtype=np.int64)
+        np.cumsum(self.offsets[Pid + 1] - self.offsets[Pid], out=Offsets[1:])
+        return PathSet(self.router[Index], self.ic[Index], self.oc[Index], self.channel[Index], Offsets)
+
+    def __path(self, name):
+        return "{}/xy_d{}_h{}_{}.npy".format(self.cache_dir, self.d, self.h, name)
+
+    def __build(self):
+        print("log: Building XY route table for a {} x {} mesh".format(self.d, self.h))
+        rter = XYRouting({"d": self.d, "h": self.h})
+        rter.use_table = False
+        Src, Dst = np.divmod(np.arange(self.n**2), self.n)
+        pkt_path = rter.batchPath(Src, Dst)
+        self.router, self.channel, self.offsets = pkt_path.router, pkt_path.channel, pkt_path.offsets
+        self.ic, self.oc = pkt_path.ic.astype(np.int8), pkt_path.oc.astype(np.int8)
+        self.nbr_r, self.nbr_ic = rter.neighborTable()
+        self.channel_table = rter.channels(np.arange(self.n)[:, np.newaxis], np.arange(len(PORT2IDX)))
+
+    def __save(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in self.fields:
+                tmp = self.__path(name) + ".{}.tmp".format(os.getpid())
+                with open(tmp, "wb") as f:
+                    np.save(f, getattr(self, name))
+                os.replace(tmp, self.__path(name))        # atomic, other processes may be loading it
+        except OSError as e:
+            print("Warn: Failed to save the route table: {}".format(e))
+
+    def __load(self):
+        if not all(os.path.exists(self.__path(name)) for name in self.fields):
+            return False
+        for name in self.fields:
+            setattr(self, name, np.load(self.__path(name), mmap_mode="r"))
+        return True
+
+
 if __name__ == "__main__":
     r = XYRouting({"d": 4})
-    res = r.route([(1, 2, 3), (3, 1, 5)])
+    res = r.path([(1, 2, 3), (3, 1, 5)])
     print(res)